@@ -0,0 +1,106 @@
+"""
+Comprovació i benchmark de BR-21: la resolució dels candidats marcats a la font (extract_flights_from_aims(flag_overlaps=True))
+ha de donar el mateix que el bucle complet sobre tots els vols
+
+Les fonts es generen amb synthetic.generate_source_database i s'hi afegeixen els casos que depenen de l'ordre: vols
+amb la mateixa sortida real que l'anterior (empats, també amb la mateixa arribada) i vols no cancel·lats sense
+sortida o arribada real (NULL). Es comparen les files de DailyUtilization i els vols rebutjats per BR-21.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import duckdb
+import numpy as np
+import extract
+import rejections
+from rejections import RejectionSink
+import synthetic
+import transform
+
+DAILY_MEASURES = ('FlightHours', 'FlightCycles', 'NumberOfDelays', 'NumberOfCancellations', 'SumOfDelayDuration')
+
+
+def add_edge_cases(filename, every=40):
+    """
+    Modifica una fracció determinista (hash de rowid) dels vols no cancel·lats de la font
+    """
+    conn = duckdb.connect(filename)
+    conn.execute(f"""
+        CREATE TEMP TABLE previous AS
+        SELECT rowid AS id,
+            LAG(actualdeparture) OVER w AS previousdeparture,
+            LAG(actualarrival) OVER w AS previousarrival
+        FROM "AIMS".flights
+        WHERE NOT cancelled
+        WINDOW w AS (PARTITION BY aircraftregistration ORDER BY scheduleddeparture);
+
+        -- Empat de sortida amb el vol anterior
+        UPDATE "AIMS".flights SET actualdeparture = p.previousdeparture
+        FROM previous p
+        WHERE "AIMS".flights.rowid = p.id AND p.previousdeparture IS NOT NULL AND hash(p.id) % {every} = 0;
+
+        -- Empat de sortida i arribada amb el vol anterior
+        UPDATE "AIMS".flights SET actualdeparture = p.previousdeparture, actualarrival = p.previousarrival
+        FROM previous p
+        WHERE "AIMS".flights.rowid = p.id AND p.previousdeparture IS NOT NULL AND hash(p.id) % {every} = 1;
+
+        -- Vols no cancel·lats sense arribada o sense sortida real
+        UPDATE "AIMS".flights SET actualarrival = NULL
+        WHERE NOT cancelled AND hash(rowid) % {every} = 2;
+        UPDATE "AIMS".flights SET actualdeparture = NULL
+        WHERE NOT cancelled AND hash(rowid) % {every} = 3;
+        """)
+    conn.close()
+
+
+def run_br21(flag_overlaps, rejections_filename):
+    """
+    Retorna (files diàries, {(aeronau, sortida programada) rebutjades per BR-21}, segons de la transformació)
+    """
+    rejection_sink = RejectionSink(rejections_filename)
+    flights = list(extract.extract_flights_from_aims(flag_overlaps=flag_overlaps))
+    start = time.perf_counter()
+    daily = list(transform.transform_daily_utilization(iter(flights), apply_cleaning=True, rejection_sink=rejection_sink))
+    seconds = time.perf_counter() - start
+    rejection_sink.close()
+
+    with open(rejections_filename, encoding='utf-8') as rejections_file:
+        rejected = {
+            (rejection['record']['aircraftregistration'], rejection['record']['scheduleddeparture'])
+            for rejection in map(json.loads, rejections_file)
+            if rejection['reason'] == rejections.OVERLAPPING_FLIGHT
+        }
+    return daily, rejected, seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Comprovació de BR-21 amb candidats marcats a la font")
+    parser.add_argument('--aircraft', type=int, default=50)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--dirty-ratio', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        filename = os.path.join(workdir, 'sources.duckdb')
+        data_directory = os.path.join(workdir, 'data')
+        synthetic.generate_source_database(filename, data_directory, n_aircraft=args.aircraft, n_days=args.days,
+                                           dirty_ratio=args.dirty_ratio, seed=args.seed)
+        add_edge_cases(filename)
+        extract.configure_source('duckdb', filename, data_directory)
+
+        full_daily, full_rejected, full_seconds = run_br21(False, os.path.join(workdir, 'full.jsonl'))
+        flagged_daily, flagged_rejected, flagged_seconds = run_br21(True, os.path.join(workdir, 'flagged.jsonl'))
+
+    # Els dos camins han de rebutjar els mateixos vols i donar les mateixes files diàries
+    assert flagged_rejected == full_rejected, sorted(full_rejected ^ flagged_rejected)[:10]
+    assert [(row['date'], row['aircraftregistration']) for row in flagged_daily] == \
+        [(row['date'], row['aircraftregistration']) for row in full_daily]
+    for measure in DAILY_MEASURES:
+        assert np.allclose([row[measure] for row in flagged_daily], [row[measure] for row in full_daily]), measure
+
+    print(f"BR-21: {len(full_rejected)} vols rebutjats, {len(full_daily)} files diàries iguals pels dos camins")
+    print(f"Full loop: {full_seconds:.4f} seconds")
+    print(f"Flagged at source: {flagged_seconds:.4f} seconds")
@@ -0,0 +1,56 @@
+"""
+Pressupost de temps d'arrencada (python -X importtime) del camí només-DW de query_test.py
+
+Comprova que importar el mòdul no carrega les dependències de l'ETL (pandas, pygrametl, psycopg2, tqdm) i que el
+temps d'import acumulat (mediana de diverses execucions en processos nous) no supera el pressupost.
+Surt amb codi 1 si es supera, per poder-ho executar a la CI o abans de desplegar al planificador.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+FORBIDDEN_MODULES = ('pandas', 'pygrametl', 'psycopg2', 'tqdm')
+DEFAULT_BUDGET_MS = 150
+
+
+def import_profile(module):
+    """
+    Retorna ({mòdul de primer nivell importat}, temps acumulat de l'import de module en ms)
+    """
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    imported = set()
+    total_us = None
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imported.add(name.strip().split('.')[0])
+        if name.strip() == module:
+            total_us = int(cumulative)
+    return imported, total_us / 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pressupost d'import del camí només-DW de query_test.py")
+    parser.add_argument('--module', default='query_test')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument('--repetitions', type=int, default=5)
+    args = parser.parse_args()
+
+    timings = []
+    for _ in range(args.repetitions):
+        imported, milliseconds = import_profile(args.module)
+        timings.append(milliseconds)
+    median_ms = statistics.median(timings)
+    forbidden = sorted(set(FORBIDDEN_MODULES) & imported)
+
+    print(f"import {args.module}: {median_ms:.1f} ms (mediana de {args.repetitions}, pressupost {args.budget_ms:.0f} ms)")
+    if forbidden:
+        print(f"Dependències de l'ETL carregades en importar {args.module}: {', '.join(forbidden)}")
+    if forbidden or median_ms > args.budget_ms:
+        sys.exit(1)
@@ -0,0 +1,76 @@
+"""
+Microbenchmark del kernel de mètriques de vols (BR-23 i mètriques de DailyUtilization): cost per milió de vols
+del càlcul anterior amb Timedelta de pandas respecte al kernel NumPy sobre int64 de transform.py
+"""
+import argparse
+import numpy as np
+import pandas as pd
+from timing import time_query
+import transform
+
+
+def generate_flights(n_flights, seed=0):
+    rng = np.random.default_rng(seed)
+    scheduled_departure = pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 365 * 24 * 60, n_flights), unit='min')
+    duration = pd.to_timedelta(rng.integers(60, 210, n_flights), unit='min')
+    delay = pd.to_timedelta(np.round(rng.exponential(12, n_flights)), unit='min')
+    df = pd.DataFrame({
+        'scheduledarrival': scheduled_departure + duration,
+        'actualdeparture': scheduled_departure + delay,
+        'actualarrival': scheduled_departure + delay + duration,
+        'cancelled': rng.random(n_flights) < 0.03
+    })
+    inverted = rng.random(n_flights) < 0.01
+    df.loc[inverted, ['actualdeparture', 'actualarrival']] = df.loc[inverted, ['actualarrival', 'actualdeparture']].values
+    df.loc[df['cancelled'], ['actualdeparture', 'actualarrival']] = pd.NaT
+    for column in ('scheduledarrival', 'actualdeparture', 'actualarrival'):
+        df[column] = df[column].astype('datetime64[ns]')
+    return df
+
+
+def pandas_metrics(df):
+    """
+    Càlcul anterior de transform_daily_utilization (referència)
+    """
+    df = df.copy()
+    inverted_dates_mask = df['actualarrival'] < df['actualdeparture']
+    df.loc[inverted_dates_mask, ['actualdeparture', 'actualarrival']] = \
+        df.loc[inverted_dates_mask, ['actualarrival', 'actualdeparture']].values
+
+    df['FlightCycles'] = 1
+    df.loc[df['cancelled'], 'FlightCycles'] = 0
+    df['NumberOfCancellations'] = df['cancelled'].astype(int)
+    df['FlightHours'] = (df['actualarrival'] - df['actualdeparture']).dt.total_seconds() / 3600
+    df.loc[df['cancelled'], 'FlightHours'] = 0
+    is_delayed = ((df['actualarrival'] - df['scheduledarrival']).dt.total_seconds() / 60) > 15
+    df['NumberOfDelays'] = (is_delayed & ~df['cancelled']).astype(int)
+    df['SumOfDelayDuration'] = (df['actualarrival'] - df['scheduledarrival']).dt.total_seconds() / 60
+    df.loc[~is_delayed | df['cancelled'], 'SumOfDelayDuration'] = 0
+    return df
+
+
+def numpy_metrics(df):
+    actual_departure, actual_arrival, _ = transform.swap_inverted_times(
+        transform.to_epoch_ns(df['actualdeparture']), transform.to_epoch_ns(df['actualarrival']))
+    return transform.compute_flight_metrics(
+        actual_departure, actual_arrival, transform.to_epoch_ns(df['scheduledarrival']), df['cancelled'].to_numpy(dtype=bool))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Microbenchmark del kernel de mètriques de vols")
+    parser.add_argument('--flights', type=int, default=1_000_000)
+    parser.add_argument('--repetitions', type=int, default=5)
+    args = parser.parse_args()
+
+    df = generate_flights(args.flights)
+
+    # Els dos càlculs han de donar els mateixos totals
+    reference = pandas_metrics(df)
+    kernel = numpy_metrics(df)
+    for column, values in kernel.items():
+        assert np.isclose(np.nansum(reference[column].to_numpy(dtype=float)), values.sum()), column
+
+    millions = args.flights / 1_000_000
+    for name, function in (('pandas Timedelta', pandas_metrics), ('NumPy int64 kernel', numpy_metrics)):
+        seconds = time_query(lambda: function(df), args.repetitions)[0]
+        print(f"{name}: {seconds:.4f} seconds for {args.flights} flights ({seconds / millions:.4f} seconds per million)")
@@ -0,0 +1,49 @@
+"""
+Compara el temps de càrrega i de consulta de cada disseny físic de les taules de fets
+"""
+import argparse
+import os
+import tempfile
+import time
+from dw import DW, PHYSICAL_DESIGNS
+import synthetic
+from timing import time_query
+
+
+def benchmark_design(physical_design, n_aircraft, n_days, repetitions, workdir, wide_facts=False):
+    filename = os.path.join(workdir, f"dw_{physical_design}.duckdb")
+    dw = DW(create=True, physical_design=physical_design, filename=filename, wide_facts=wide_facts)
+
+    start = time.perf_counter()
+    loaded_rows = synthetic.load_synthetic_dw(dw, n_aircraft=n_aircraft, n_days=n_days)
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dw.finalize_physical_design()
+    finalize_time = time.perf_counter() - start
+
+    query_times = {
+        name: time_query(getattr(dw, name), repetitions)[0]
+        for name in ('query_utilization', 'query_reporting', 'query_reporting_per_role')
+    }
+    dw.close()
+    return loaded_rows, load_time, finalize_time, query_times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark del disseny físic del DW")
+    parser.add_argument('--aircraft', type=int, default=50)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--repetitions', type=int, default=5)
+    parser.add_argument('--wide-facts', action='store_true', help="Usa el layout ample (any i fabricant a les taules de fets)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for physical_design in PHYSICAL_DESIGNS:
+            loaded_rows, load_time, finalize_time, query_times = benchmark_design(
+                physical_design, args.aircraft, args.days, args.repetitions, workdir, args.wide_facts)
+            print(f"\n================================ {physical_design} ======================================")
+            print(f"Fact rows: {loaded_rows}")
+            print(f"Load time: {load_time:.4f} seconds (+ {finalize_time:.4f} seconds post-load)")
+            for name, seconds in query_times.items():
+                print(f"{name}: {seconds:.4f} seconds (median of {args.repetitions})")
@@ -0,0 +1,61 @@
+"""
+Benchmark reproduïble sense PostgreSQL: genera les fonts AIMS/AMOS en DuckDB, mesura el throughput d'extracció,
+executa l'ETL i compara les consultes baseline amb les del DW
+"""
+import argparse
+import os
+import tempfile
+import time
+from dw import open_queries
+import etl_control_flow
+import extract
+import synthetic
+from timing import time_query
+
+
+def time_extraction(function):
+    start = time.perf_counter()
+    rows = sum(1 for _ in function())
+    return rows, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark d'extracció i baseline vs DW sobre fonts sintètiques")
+    parser.add_argument('--aircraft', type=int, default=50)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--flights-per-day', type=int, default=3)
+    parser.add_argument('--repetitions', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        source_filename = os.path.join(workdir, 'sources.duckdb')
+        data_directory = os.path.join(workdir, 'data')
+        generated = synthetic.generate_source_database(
+            source_filename, data_directory, n_aircraft=args.aircraft, n_days=args.days,
+            flights_per_day=args.flights_per_day, seed=args.seed)
+        print(f"Generated sources: {generated}")
+        extract.configure_source('duckdb', filename=source_filename, data_directory=data_directory)
+
+        print("\n*************************************************** Extraction throughput")
+        for function in (extract.extract_flights_from_aims, extract.extract_maintenance_from_aims, extract.extract_reports_from_amos):
+            rows, seconds = time_extraction(function)
+            print(f"{function.__name__}: {rows} rows in {seconds:.4f} seconds ({rows / seconds:.0f} rows/s)")
+
+        print("\n*************************************************** ETL")
+        dw_filename = os.path.join(workdir, 'dw.duckdb')
+        start = time.perf_counter()
+        etl_control_flow.run_etl(filename=dw_filename, rejections_filename=os.path.join(workdir, 'cleaning.jsonl'))
+        print(f"ETL time: {time.perf_counter() - start:.4f} seconds")
+
+        dw = open_queries(dw_filename) # Només lectura, com query_service.py
+        for name, dw_query, baseline_query in (
+            ('Aircraft Utilization', dw.query_utilization, extract.query_utilization_baseline),
+            ('Reporting', dw.query_reporting, extract.query_reporting_baseline),
+            ('Reporting per Role', dw.query_reporting_per_role, extract.query_reporting_per_role_baseline),
+        ):
+            print(f"\n*************************************************** Query {name}")
+            print(f"DW:       {time_query(dw_query, args.repetitions)[0]:.4f} seconds (median of {args.repetitions})")
+            print(f"Baseline: {time_query(baseline_query, args.repetitions)[0]:.4f} seconds (median of {args.repetitions})")
+        dw.close()
+        extract.configure_source('duckdb') # Tanca la connexió abans d'esborrar el directori temporal
@@ -0,0 +1,151 @@
+"""
+Compara l'espai en disc i la latència de les consultes de KPIs de cada layout d'emmagatzematge de les taules de fets
+(enters estrets, FLOAT o DECIMAL, compressió de DuckDB i Parquet zstd) a volums sintètics escalats
+
+Cada layout es construeix, es publica i es consulta en només lectura com ho faria query_service.py. Els bytes per fila
+de fets només compten les taules de fets (blocs de pragma_storage_info o fitxers Parquet): les dimensions i les taules
+derivades com DailyCumulative no depenen del layout. El total del fitxer publicat s'informa a part.
+Els resultats de cada layout es comparen amb els del primer (les mesures FLOAT no són exactes).
+"""
+import argparse
+import glob
+import os
+import tempfile
+import time
+from dw import DW, FACT_SORT_KEYS, PHYSICAL_DESIGNS, STORAGE_LAYOUTS, open_queries
+import synthetic
+from timing import time_query
+
+QUERIES = ('query_utilization', 'query_reporting', 'query_reporting_per_role')
+
+
+def storage_bytes(queries, filename):
+    """
+    Retorna (bytes en disc, bytes en ús) del DW publicat més els fitxers Parquet que en depenen
+    DuckDB no retorna al sistema els blocs alliberats (p. ex. en reordenar amb el disseny sorted): només compten els usats
+    """
+    parquet_bytes = sum(
+        os.path.getsize(parquet_file) for parquet_file in glob.glob(f"{glob.escape(os.path.abspath(filename))}.*.parquet")
+    )
+    used_bytes = queries.conn_duckdb.execute("SELECT block_size * used_blocks FROM pragma_database_size()").fetchone()[0]
+    return os.path.getsize(filename) + parquet_bytes, used_bytes + parquet_bytes
+
+
+def fact_table_bytes(queries, filename):
+    """
+    Retorna {taula de fets: (bytes, files)}: blocs que fan servir els segments de la taula (un bloc compartit amb una
+    altra taula compta sencer) o, amb el layout parquet, la mida del fitxer Parquet de la darrera publicació
+    """
+    block_size = queries.conn_duckdb.execute("SELECT block_size FROM pragma_database_size()").fetchone()[0]
+    table_bytes = {}
+    for table in FACT_SORT_KEYS:
+        rows = queries.conn_duckdb.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        if queries.has_parquet_facts():
+            parquet_files = glob.glob(f"{glob.escape(os.path.abspath(filename))}.{table}.*.parquet")
+            current_file = max(parquet_files, key=lambda parquet_file: int(parquet_file.rsplit('.', 2)[1]))
+            table_bytes[table] = (os.path.getsize(current_file), rows)
+            continue
+        blocks = queries.conn_duckdb.execute(f"""
+            SELECT COUNT(DISTINCT block) FROM (
+                SELECT block_id AS block FROM pragma_storage_info('{table}') WHERE block_id >= 0
+                UNION ALL
+                SELECT UNNEST(additional_block_ids) AS block FROM pragma_storage_info('{table}')
+            )
+            """).fetchone()[0]
+        table_bytes[table] = (blocks * block_size, rows)
+    return table_bytes
+
+
+def max_relative_difference(reference, result):
+    """
+    Diferència relativa màxima entre les columnes numèriques de dos resultats (None si tenen files diferents)
+    """
+    if len(reference) != len(result):
+        return None
+    difference = 0.0
+    for reference_row, row in zip(reference, result):
+        for expected, value in zip(reference_row, row):
+            if isinstance(expected, str) or expected is None or value is None:
+                if expected != value:
+                    return None
+                continue
+            expected, value = float(expected), float(value)
+            difference = max(difference, abs(value - expected) / max(abs(expected), 1e-9))
+    return difference
+
+
+def compression_methods(queries, table='DailyUtilization'):
+    """
+    Mètodes de compressió que DuckDB ha fet servir per cada columna (buit si la taula és una vista sobre Parquet)
+    """
+    if queries.has_parquet_facts():
+        return {}
+    rows = queries.conn_duckdb.execute(f"""
+        SELECT column_name, string_agg(DISTINCT compression, ', ' ORDER BY compression)
+        FROM pragma_storage_info('{table}')
+        WHERE segment_type <> 'VALIDITY'
+        GROUP BY column_name, column_id
+        ORDER BY column_id
+        """).fetchall()
+    return dict(rows)
+
+
+def benchmark_layout(storage_layout, n_aircraft, n_days, repetitions, workdir, physical_design='constrained', wide_facts=False):
+    filename = os.path.join(workdir, f"dw_{storage_layout}.duckdb")
+    dw = DW(create=True, physical_design=physical_design, filename=filename, wide_facts=wide_facts,
+            storage_layout=storage_layout)
+
+    start = time.perf_counter()
+    loaded_rows = synthetic.bulk_load_synthetic_dw(dw, n_aircraft=n_aircraft, n_days=n_days)
+    dw.finalize_physical_design()
+    dw.close() # Valida i publica (amb parquet, hi mou els fets)
+    build_time = time.perf_counter() - start
+
+    queries = open_queries(filename)
+    query_times, results = {}, {}
+    for name in QUERIES:
+        query_times[name], results[name] = time_query(getattr(queries, name), repetitions)
+    compression = compression_methods(queries)
+    file_bytes, used_bytes = storage_bytes(queries, filename)
+    table_bytes = fact_table_bytes(queries, filename)
+    queries.close()
+    return loaded_rows, build_time, file_bytes, used_bytes, table_bytes, compression, query_times, results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark de l'espai i la latència de cada layout de les taules de fets")
+    parser.add_argument('--aircraft', type=int, default=500)
+    parser.add_argument('--days', type=int, default=1825)
+    parser.add_argument('--repetitions', type=int, default=5)
+    parser.add_argument('--layouts', nargs='+', choices=tuple(STORAGE_LAYOUTS), default=list(STORAGE_LAYOUTS))
+    parser.add_argument('--physical-design', choices=PHYSICAL_DESIGNS, default='constrained')
+    parser.add_argument('--wide-facts', action='store_true', help="Usa el layout ample (any i fabricant a les taules de fets)")
+    args = parser.parse_args()
+
+    reference = None
+    with tempfile.TemporaryDirectory() as workdir:
+        for storage_layout in args.layouts:
+            loaded_rows, build_time, file_bytes, used_bytes, table_bytes, compression, query_times, results = benchmark_layout(
+                storage_layout, args.aircraft, args.days, args.repetitions, workdir, args.physical_design, args.wide_facts)
+            print(f"\n================================ {storage_layout} ======================================")
+            print(f"Layout: {STORAGE_LAYOUTS[storage_layout]}")
+            print(f"Fact rows: {loaded_rows}")
+            print(f"Build time: {build_time:.4f} seconds (load, post-load and publish)")
+            fact_bytes = sum(table_size for table_size, _ in table_bytes.values())
+            print(f"Fact storage: {fact_bytes} bytes ({fact_bytes / loaded_rows:.2f} bytes per fact row)")
+            for table, (table_size, rows) in table_bytes.items():
+                print(f"    {table}: {table_size} bytes ({table_size / max(rows, 1):.2f} bytes per row)")
+            print(f"Published DW: {used_bytes} bytes in use, {file_bytes} on disk (dimensions and derived tables included)")
+            if compression:
+                print(f"DailyUtilization compression: {', '.join(f'{column} {methods}' for column, methods in compression.items())}")
+            for name, seconds in query_times.items():
+                print(f"{name}: {seconds:.4f} seconds (median of {args.repetitions})")
+            if reference is None:
+                reference = (storage_layout, results)
+                continue
+            for name, result in results.items():
+                difference = max_relative_difference(reference[1][name], result)
+                if difference is None:
+                    print(f"{name}: different rows than {reference[0]}")
+                elif difference > 0:
+                    print(f"{name}: max relative difference vs {reference[0]} {difference:.2e}")
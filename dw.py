@@ -1,141 +1,472 @@
+import glob
 import os
+import re
 import sys
+import time
 import duckdb # https://duckdb.org
-import pygrametl # https://pygrametl.org
-from pygrametl.tables import CachedDimension, FactTable
+from kpi import KPIEngine
 
 
 duckdb_filename = 'dw.duckdb'
 
+# Disseny físic de les taules de fets:
+# - constrained: PK i FK declarades (DuckDB les comprova a cada insert)
+# - sorted: càrrega sense restriccions i ordenació posterior per (DateKey/MonthKey, AircraftKey) pels zone-maps
+# - indexed: com sorted, i a més índexs ART creats després de la càrrega
+PHYSICAL_DESIGNS = ('constrained', 'sorted', 'indexed')
 
-class DW:
-    def __init__(self, create=False):
-        if create and os.path.exists(duckdb_filename):
-            os.remove(duckdb_filename)
-        try:
-            self.conn_duckdb = duckdb.connect(duckdb_filename)
-            print("Connection to the DW created successfully")
-        except duckdb.Error as e:
-            print(f"Unable to connect to DuckDB database '{duckdb_filename}':", e)
-            sys.exit(1)
-
-        if create:
-            try:
-                # TODO: Create the tables in the DW
-                self.conn_duckdb.execute('''
-                    CREATE TABLE Date (
-                        DateKey INT PRIMARY KEY,
-                        FullDate VARCHAR(10),
-                        Day INT,
-                        Month INT,
-                        Year INT
-                    );
-
-                    CREATE TABLE Month (
-                        MonthKey INT PRIMARY KEY,
-                        Month INT,
-                        Year INT
-                    );
-
-                    CREATE TABLE Aircraft (
-                        AircraftKey INT PRIMARY KEY,
-                        AircraftRegistrationCode VARCHAR(10),
-                        AircraftModel VARCHAR(30),
-                        AircraftManufacturer VARCHAR(30)
-                    );
-
-                    CREATE TABLE DailyUtilization (
-                        DateKey INT,
-                        AircraftKey INT,
-                        FlightHours DECIMAL(10, 2),
-                        FlightCycles INT,
-                        NumberOfDelays INT,
-                        NumberOfCancellations INT,
-                        SumOfDelayDuration INT,
+# Restriccions i ordre físic de cada taula de fets
+FACT_CONSTRAINTS = {
+    'DailyUtilization': '''
                         PRIMARY KEY (DateKey, AircraftKey),
                         FOREIGN KEY (DateKey) REFERENCES Date(DateKey),
-                        FOREIGN KEY (AircraftKey) REFERENCES Aircraft(AircraftKey)
-                    );
-
-                    CREATE TABLE MonthlyAircraftSummary (
-                        MonthKey INT,
-                        AircraftKey INT,
-                        ADIS DECIMAL(10, 2),
-                        ADOSS DECIMAL(10, 2),
-                        ADOSU DECIMAL(10, 2),
-                        PilotReportCount INT,
+                        FOREIGN KEY (AircraftKey) REFERENCES Aircraft(AircraftKey)''',
+    'MonthlyAircraftSummary': '''
                         PRIMARY KEY (MonthKey, AircraftKey),
                         FOREIGN KEY (MonthKey) REFERENCES Month(MonthKey),
-                        FOREIGN KEY (AircraftKey) REFERENCES Aircraft(AircraftKey)
-                    );
-
-                    CREATE TABLE MonthlyMaintenanceReports (
-                        MonthKey INT,
-                        AircraftKey INT,
-                        AirportCode VARCHAR(4),
-                        MaintenanceReportCount INT,
+                        FOREIGN KEY (AircraftKey) REFERENCES Aircraft(AircraftKey)''',
+    'MonthlyMaintenanceReports': '''
                         PRIMARY KEY (MonthKey, AircraftKey, AirportCode),
                         FOREIGN KEY (MonthKey) REFERENCES Month(MonthKey),
-                        FOREIGN KEY (AircraftKey) REFERENCES Aircraft(AircraftKey)
-                    );
-                    ''')
-                print("[dw.py] S'han creat les taules correctament")
-            except duckdb.Error as e:
-                print("[dw.py] Error creant les taules:", e)
-                sys.exit(2)
+                        FOREIGN KEY (AircraftKey) REFERENCES Aircraft(AircraftKey)''',
+}
 
-        # Link DuckDB and pygrametl
-        self.conn_pygrametl = pygrametl.ConnectionWrapper(self.conn_duckdb)
+# Columnes desnormalitzades opcionals (layout ample): evita els joins amb Date/Month i Aircraft a les consultes
+WIDE_FACT_ATTRIBUTES = ('Year', 'ManufacturerCode')
 
-        # ======================================================================================================= Dimension and fact table objects
-        # TODO: Declare the dimensions and facts for pygrametl
-        self.date_dim = CachedDimension(
-            name='Date',
-            key='DateKey',
-            attributes=('FullDate', 'Day', 'Month', 'Year'),
-            lookupatts=('DateKey',)
-        )
+FACT_SORT_KEYS = {
+    'DailyUtilization': ('DateKey', 'AircraftKey'),
+    'MonthlyAircraftSummary': ('MonthKey', 'AircraftKey'),
+    'MonthlyMaintenanceReports': ('MonthKey', 'AircraftKey', 'AirportCode'),
+}
 
-        self.month_dim = CachedDimension(
-            name='Month',
-            key='MonthKey',
-            attributes=('Month', 'Year'),
-            lookupatts=('MonthKey',)
-        )
+# Mode aproximat (DWQueries.approximate_*): mostra per blocs de DailyUtilization (TABLESAMPLE ... (system))
+# Divisor de DateKey (YYYYMMDD) i de MonthKey (YYYYMM) per obtenir el període sense joins amb Date/Month
+APPROXIMATE_GRANULARITIES = {
+    'year': (10000, 100),
+    'month': (100, 1),
+}
+SAMPLE_BLOCK_ROWS = 2048 # DuckDB mostreja vectors sencers: cada bloc és una unitat de mostreig (rowid // 2048)
+DEFAULT_SAMPLE_PERCENT = 10
+MIN_SAMPLED_BLOCKS = 10 # Per sota, el període es calcula exactament (l'aproximació normal de l'interval no val)
+MAX_SAMPLE_PERCENT = 50 # Si cal mostrejar més per arribar al mínim de blocs, no es mostreja: es llegeix tot igualment
 
-        self.aircraft_dim = CachedDimension(
-            name='Aircraft',
-            key='AircraftKey',
-            attributes=('AircraftRegistrationCode', 'AircraftModel', 'AircraftManufacturer'),
-            lookupatts=('AircraftRegistrationCode',)
-        )
+# Layout d'emmagatzematge de les taules de fets:
+# - integers: 'int' o 'narrow' (AircraftKey USMALLINT també a Aircraft, perquè les FK han de tenir el tipus de la PK,
+#   i comptadors UTINYINT/USMALLINT; DateKey, MonthKey i SumOfDelayDuration continuen sent INT)
+# - measures: 'decimal' (DECIMAL(10, 2), exacte) o 'float' (FLOAT de 4 bytes)
+# - compression: force_compression de DuckDB; si el mètode no es pot aplicar a una columna, DuckDB en tria un altre
+# - parquet: en publicar, els fets es mouen a fitxers Parquet (zstd) al costat del DW i es consulten per vistes
+STORAGE_LAYOUTS = {
+    'default': {'integers': 'int', 'measures': 'decimal', 'compression': 'auto', 'parquet': False},
+    'narrow': {'integers': 'narrow', 'measures': 'decimal', 'compression': 'auto', 'parquet': False},
+    'float': {'integers': 'narrow', 'measures': 'float', 'compression': 'auto', 'parquet': False},
+    'uncompressed': {'integers': 'int', 'measures': 'decimal', 'compression': 'uncompressed', 'parquet': False},
+    'parquet': {'integers': 'narrow', 'measures': 'decimal', 'compression': 'auto', 'parquet': True},
+}
+INTEGER_TYPES = {
+    'int': {'AircraftKey': 'INT', 'DailyCount': 'INT', 'MonthlyCount': 'INT'},
+    'narrow': {'AircraftKey': 'USMALLINT', 'DailyCount': 'UTINYINT', 'MonthlyCount': 'USMALLINT'},
+}
+MEASURE_TYPES = {
+    'decimal': 'DECIMAL(10, 2)',
+    'float': 'FLOAT',
+}
 
-        self.daily_utilization_fact = FactTable(
-            name='DailyUtilization',
-            keyrefs=('DateKey', 'AircraftKey'),
-            measures=('FlightHours', 'FlightCycles', 'NumberOfDelays', 'NumberOfCancellations', 'SumOfDelayDuration')
-        )
 
-        self.monthly_summary_fact = FactTable(
-            name='MonthlyAircraftSummary',
-            keyrefs=('MonthKey', 'AircraftKey'),
-            measures=('ADIS', 'ADOSS', 'ADOSU', 'PilotReportCount')
-        )
+def build_filename(filename):
+    """
+    Fitxer on es construeix un DW abans de publicar-lo
+    """
+    return f"{filename}.building"
 
-        self.monthly_maintenance_reports_fact = FactTable(
-            name='MonthlyMaintenanceReports',
-            keyrefs=('MonthKey', 'AircraftKey', 'AirportCode'),
-            measures=('MaintenanceReportCount',)
+
+def open_queries(filename=duckdb_filename):
+    """
+    Consultes sobre un DW publicat en només lectura, sense carregar pygrametl
+    """
+    return DWQueries(duckdb.connect(filename, read_only=True))
+
+
+class DWQueries:
+    """
+    Consultes de KPIs sobre una connexió DuckDB qualsevol (la del DW o una de només lectura)
+    """
+    def __init__(self, conn_duckdb):
+        self.conn_duckdb = conn_duckdb
+        # Un DW existent manté el layout amb què es va crear
+        self.wide_facts = self._has_wide_facts()
+        # Amb el layout parquet els fets són vistes sobre read_parquet: el número de fila el dona file_row_number
+        self._row_number = 'file_row_number' if self.has_parquet_facts() else 'rowid'
+        self._manufacturer_names = None # ManufacturerCode -> AircraftManufacturer
+
+    def _has_wide_facts(self):
+        result = self.conn_duckdb.execute("""
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_name = 'DailyUtilization' AND column_name = 'ManufacturerCode'
+            """).fetchone()
+        return result[0] > 0
+
+    def has_parquet_facts(self):
+        """
+        Cert si el DW té el layout parquet: els fets són vistes sobre fitxers Parquet en lloc de taules
+        """
+        result = self.conn_duckdb.execute("""
+            SELECT COUNT(*) FROM information_schema.tables
+            WHERE table_name = 'DailyUtilization' AND table_type = 'VIEW'
+            """).fetchone()
+        return result[0] > 0
+
+    def _fact_source(self, table, alias):
+        """
+        Retorna (FROM, expressió de fabricant, expressió d'any) per llegir una taula de fets
+        Amb el layout ample no cal cap join: l'any i el codi de fabricant són a la mateixa fila
+        """
+        if self.wide_facts:
+            return f"{table} {alias}", f"{alias}.ManufacturerCode", f"{alias}.Year"
+        period_join = (
+            f"JOIN Date d_{alias} ON {alias}.DateKey = d_{alias}.DateKey" if table == 'DailyUtilization'
+            else f"JOIN Month d_{alias} ON {alias}.MonthKey = d_{alias}.MonthKey"
         )
+        from_clause = f"""{table} {alias}
+                    {period_join}
+                    JOIN Aircraft a_{alias} ON {alias}.AircraftKey = a_{alias}.AircraftKey"""
+        return from_clause, f"a_{alias}.AircraftManufacturer", f"d_{alias}.Year"
+
+    def _decode_manufacturers(self, result):
+        if not self.wide_facts:
+            return result
+        if self._manufacturer_names is None:
+            self._manufacturer_names = dict(self.conn_duckdb.execute(
+                "SELECT ManufacturerCode, AircraftManufacturer FROM Manufacturer"
+            ).fetchall())
+        return [(self._manufacturer_names[row[0]],) + tuple(row[1:]) for row in result]
+
+    def close(self):
+        self.conn_duckdb.close()
+
+    def _manufacturer_source(self, table, alias, sample=''):
+        """
+        Retorna (FROM, expressió de fabricant) sense join amb Date/Month; sample s'afegeix just després de la taula
+        """
+        if self.wide_facts:
+            return f"{table} {alias} {sample}", f"{alias}.ManufacturerCode"
+        from_clause = f"""{table} {alias} {sample}
+                    JOIN Aircraft a_{alias} ON {alias}.AircraftKey = a_{alias}.AircraftKey"""
+        return from_clause, f"a_{alias}.AircraftManufacturer"
+
+    def _effective_sample_percent(self, date_divisor, sample_percent):
+        """
+        Percentatge de mostreig perquè un període mitjà tingui 2 * MIN_SAMPLED_BLOCKS blocs a la mostra: s'apuja el demanat
+        si no n'hi ha prou. None si caldria més de MAX_SAMPLE_PERCENT: no es mostreja i tot es calcula exactament
+        Per mesos i a 10%, cal un DW d'uns 200 blocs (~410k files diàries) per mes; per sota, el mode mensual és exacte
+        """
+        fact_rows = self.conn_duckdb.execute("SELECT COUNT(*) FROM DailyUtilization").fetchone()[0]
+        periods = self.conn_duckdb.execute(f"SELECT COUNT(DISTINCT DateKey // {date_divisor}) FROM Date").fetchone()[0]
+        if not fact_rows:
+            return sample_percent
+        needed_percent = 100 * 2 * MIN_SAMPLED_BLOCKS / (fact_rows / SAMPLE_BLOCK_ROWS / periods)
+        if needed_percent > MAX_SAMPLE_PERCENT:
+            return None
+        return max(sample_percent, needed_percent)
+
+    def _sampled_estimates_sql(self, granularity, sample_percent, confidence, seed):
+        """
+        CTEs del mode aproximat. Retorna (SQL, divisor de MonthKey); el CTE estimates té, per fabricant i període, els
+        blocs mostrejats, i FH, cicles, DYR i CNR estimats amb el seu marge d'error (semiamplada de l'interval), i el
+        CTE fleet les aeronaus de cada grup
+        Cada bloc de la mostra és un conglomerat i totes les estimacions són estimadors de raó:
+        - sumes: files del període a DailyUtilization (exacte) * suma del grup / files del període a la mostra
+        - DYR i CNR: retards (o cancel·lacions) / cicles del grup a la mostra
+        Per a y / x, var = (1 - f) * n / (n - 1) * suma per bloc de (y - R * x)^2 / x de la mostra^2 (n blocs del període)
+        Les aeronaus són les que apareixen a la mostra o a MonthlyAircraftSummary: una cota inferior de la flota del
+        mode exacte, que només difereix si alguna aeronau vola pocs dies del període i cap d'ells entra a la mostra
+        Tots els períodes de DailyUtilization hi són: si algun grup del període (de la mostra o de MonthlyAircraftSummary)
+        té menys de MIN_SAMPLED_BLOCKS blocs, el període es calcula exactament (exact = TRUE, marges 0)
+        El percentatge de mostreig pot ser més alt que el demanat, o no mostrejar-se res (_effective_sample_percent)
+        """
+        from statistics import NormalDist
+        if granularity not in APPROXIMATE_GRANULARITIES:
+            raise ValueError(f"Unknown granularity '{granularity}' (expected one of {tuple(APPROXIMATE_GRANULARITIES)})")
+        if not 0 < sample_percent <= 100:
+            raise ValueError(f"Sample percent must be in (0, 100], got {sample_percent}")
+        if not 0 < confidence < 1:
+            raise ValueError(f"Confidence must be in (0, 1), got {confidence}")
+        date_divisor, month_divisor = APPROXIMATE_GRANULARITIES[granularity]
+        sample_percent = self._effective_sample_percent(date_divisor, sample_percent)
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        if sample_percent is None:
+            # Cap període no arribaria al mínim de blocs: la mostra és buida i tots els períodes van pel camí exacte
+            f, sample, sample_filter, exact_filter = 1, '', 'WHERE FALSE', ''
+        else:
+            method = 'system' if seed is None else f"system, {int(seed)}"
+            f, sample, sample_filter = sample_percent / 100, f"TABLESAMPLE {float(sample_percent)}% ({method})", ''
+            exact_filter = f"WHERE dx.DateKey // {date_divisor} IN (SELECT Period FROM thinPeriods)"
+
+        def ratio(y, x):
+            return f"(s.{y} / s.{x})"
+
+        def ratio_margin(y, x):
+            # abs(): la suma de residus només pot ser negativa per errors d'arrodoniment
+            return (f"{z} * sqrt(abs((1 - {f}) * s.periodBlocks / (s.periodBlocks - 1)"
+                    f" * (s.{y}2 - 2 * {ratio(y, x)} * s.{y}_{x} + {ratio(y, x)} ** 2 * s.{x}2))) / s.{x}")
+
+        du_from, du_manufacturer = self._manufacturer_source('DailyUtilization', 'du', sample)
+        dx_from, dx_manufacturer = self._manufacturer_source('DailyUtilization', 'dx')
+        ms_from, ms_manufacturer = self._manufacturer_source('MonthlyAircraftSummary', 'ms')
+        return f"""
+                sampleRows AS MATERIALIZED ( -- Una sola mostra per a tots els CTEs
+                    SELECT
+                        {du_manufacturer} AS Manufacturer,
+                        du.DateKey // {date_divisor} AS Period,
+                        du.{self._row_number} // {SAMPLE_BLOCK_ROWS} AS Block,
+                        du.AircraftKey,
+                        du.FlightHours,
+                        du.FlightCycles,
+                        du.NumberOfDelays,
+                        du.NumberOfCancellations
+                    FROM {du_from}
+                    {sample_filter}
+                ),
+                blocks AS (
+                    SELECT
+                        Manufacturer,
+                        Period,
+                        Block,
+                        CAST(SUM(FlightHours) AS DOUBLE) AS flightHours,
+                        CAST(SUM(FlightCycles) AS DOUBLE) AS flightCycles,
+                        CAST(SUM(NumberOfDelays) AS DOUBLE) AS delays,
+                        CAST(SUM(NumberOfCancellations) AS DOUBLE) AS cancellations
+                    FROM sampleRows
+                    GROUP BY ALL
+                ),
+                blockRows AS ( -- Files de cada bloc del període (de tots els fabricants)
+                    SELECT Period, Block, CAST(COUNT(*) AS DOUBLE) AS factRows
+                    FROM sampleRows
+                    GROUP BY ALL
+                ),
+                sampleTotals AS (
+                    SELECT Period, COUNT(*) AS periodBlocks, SUM(factRows) AS factRows, SUM(factRows * factRows) AS factRows2
+                    FROM blockRows
+                    GROUP BY ALL
+                ),
+                periodRows AS ( -- Exacte: només llegeix DateKey
+                    SELECT DateKey // {date_divisor} AS Period, COUNT(*) AS factRows
+                    FROM DailyUtilization
+                    GROUP BY ALL
+                ),
+                sampled AS (
+                    SELECT
+                        b.Manufacturer,
+                        b.Period,
+                        COUNT(*) AS sampledBlocks,
+                        ANY_VALUE(t.periodBlocks) AS periodBlocks,
+                        ANY_VALUE(t.factRows) AS factRows, ANY_VALUE(t.factRows2) AS factRows2,
+                        SUM(b.flightHours) AS flightHours, SUM(b.flightHours * b.flightHours) AS flightHours2,
+                        SUM(b.flightHours * r.factRows) AS flightHours_factRows,
+                        SUM(b.flightCycles) AS flightCycles, SUM(b.flightCycles * b.flightCycles) AS flightCycles2,
+                        SUM(b.flightCycles * r.factRows) AS flightCycles_factRows,
+                        SUM(b.delays) AS delays, SUM(b.delays * b.delays) AS delays2,
+                        SUM(b.delays * b.flightCycles) AS delays_flightCycles,
+                        SUM(b.cancellations) AS cancellations, SUM(b.cancellations * b.cancellations) AS cancellations2,
+                        SUM(b.cancellations * b.flightCycles) AS cancellations_flightCycles
+                    FROM blocks b
+                    JOIN blockRows r USING (Period, Block)
+                    JOIN sampleTotals t USING (Period)
+                    GROUP BY ALL
+                ),
+                monthlyAircraft AS (
+                    SELECT {ms_manufacturer} AS Manufacturer, ms.MonthKey // {month_divisor} AS Period, ms.AircraftKey
+                    FROM {ms_from}
+                ),
+                thinPeriods AS ( -- Algun grup conegut del període té massa pocs blocs a la mostra (o cap)
+                    SELECT n.Period
+                    FROM periodRows n
+                    LEFT JOIN (
+                        SELECT Manufacturer, Period FROM sampled
+                        UNION
+                        SELECT Manufacturer, Period FROM monthlyAircraft
+                    ) g USING (Period)
+                    LEFT JOIN sampled s USING (Manufacturer, Period)
+                    GROUP BY n.Period
+                    HAVING MIN(COALESCE(s.sampledBlocks, 0)) < {MIN_SAMPLED_BLOCKS}
+                ),
+                exactRows AS (
+                    SELECT
+                        {dx_manufacturer} AS Manufacturer,
+                        dx.DateKey // {date_divisor} AS Period,
+                        dx.AircraftKey,
+                        dx.FlightHours,
+                        dx.FlightCycles,
+                        dx.NumberOfDelays,
+                        dx.NumberOfCancellations
+                    FROM {dx_from}
+                    {exact_filter}
+                ),
+                fleet AS (
+                    SELECT Manufacturer, Period, COUNT(DISTINCT AircraftKey) AS aircraft
+                    FROM (
+                        SELECT Manufacturer, Period, AircraftKey FROM sampleRows
+                        UNION ALL
+                        SELECT Manufacturer, Period, AircraftKey FROM exactRows
+                        UNION ALL
+                        SELECT Manufacturer, Period, AircraftKey FROM monthlyAircraft
+                    )
+                    GROUP BY ALL
+                ),
+                estimates AS (
+                    SELECT
+                        s.Manufacturer,
+                        s.Period,
+                        s.sampledBlocks,
+                        FALSE AS exact,
+                        n.factRows * {ratio('flightHours', 'factRows')} AS flightHours,
+                        n.factRows * {ratio_margin('flightHours', 'factRows')} AS flightHoursMargin,
+                        n.factRows * {ratio('flightCycles', 'factRows')} AS flightCycles,
+                        n.factRows * {ratio_margin('flightCycles', 'factRows')} AS flightCyclesMargin,
+                        {ratio('delays', 'flightCycles')} AS DYR,
+                        {ratio_margin('delays', 'flightCycles')} AS DYRMargin,
+                        {ratio('cancellations', 'flightCycles')} AS CNR,
+                        {ratio_margin('cancellations', 'flightCycles')} AS CNRMargin
+                    FROM sampled s
+                    JOIN periodRows n USING (Period)
+                    WHERE s.Period NOT IN (SELECT Period FROM thinPeriods)
+
+                    UNION ALL
+
+                    SELECT
+                        Manufacturer,
+                        Period,
+                        NULL AS sampledBlocks,
+                        TRUE AS exact,
+                        CAST(SUM(FlightHours) AS DOUBLE) AS flightHours,
+                        0 AS flightHoursMargin,
+                        CAST(SUM(FlightCycles) AS DOUBLE) AS flightCycles,
+                        0 AS flightCyclesMargin,
+                        SUM(NumberOfDelays) / SUM(FlightCycles) AS DYR,
+                        0 AS DYRMargin,
+                        SUM(NumberOfCancellations) / SUM(FlightCycles) AS CNR,
+                        0 AS CNRMargin
+                    FROM exactRows
+                    GROUP BY ALL
+                )""", month_divisor
+
+    def approximate_utilization(self, granularity='year', sample_percent=DEFAULT_SAMPLE_PERCENT, confidence=0.95, seed=None):
+        """
+        Estimació de FH, TakeOff, DU, DC, DYR i CNR per fabricant i any o mes a partir d'una mostra per blocs de DailyUtilization
+        Cada estimació va seguida del seu marge d'error; ADOS i ADIS no es mostregen (fets mensuals)
+        Files: (fabricant, període, aeronaus, blocs mostrejats, exacte, FH, ±, TakeOff, ±, ADOS, ADIS, DU, ±, DC, ±, DYR, ±, CNR, ±)
+        Els períodes amb massa pocs blocs a la mostra es calculen exactament (exacte = True, blocs NULL i marges 0)
+        Per mesos cal un DW gran (~410k files diàries per mes); per sota, el resultat és exacte i costa com el mode exacte
+        """
+        estimates, month_divisor = self._sampled_estimates_sql(granularity, sample_percent, confidence, seed)
+        ms_from, ms_manufacturer = self._manufacturer_source('MonthlyAircraftSummary', 'ms')
+        result = self.conn_duckdb.execute(f"""
+            WITH {estimates},
+                outOfService AS (
+                    SELECT
+                        {ms_manufacturer} AS Manufacturer,
+                        ms.MonthKey // {month_divisor} AS Period,
+                        CAST(SUM(ms.ADOSS + ms.ADOSU) AS DOUBLE) AS outOfService
+                    FROM {ms_from}
+                    GROUP BY ALL
+                ),
+                periods AS (
+                    SELECT MonthKey // {month_divisor} AS Period, SUM(CoveredDays) AS PeriodDays
+                    FROM Month
+                    GROUP BY ALL
+                ),
+                kpis AS (
+                    SELECT
+                        e.*,
+                        fl.aircraft,
+                        e.flightHours / fl.aircraft AS FH,
+                        e.flightHoursMargin / fl.aircraft AS FHMargin,
+                        e.flightCycles / fl.aircraft AS TakeOff,
+                        e.flightCyclesMargin / fl.aircraft AS TakeOffMargin,
+                        COALESCE(o.outOfService, 0) / fl.aircraft AS ADOS,
+                        p.PeriodDays - COALESCE(o.outOfService, 0) / fl.aircraft AS ADIS
+                    FROM estimates e
+                    JOIN fleet fl USING (Manufacturer, Period)
+                    JOIN periods p USING (Period)
+                    LEFT JOIN outOfService o USING (Manufacturer, Period)
+                )
+            SELECT
+                Manufacturer,
+                Period,
+                aircraft,
+                sampledBlocks,
+                exact,
+                ROUND(FH, 2), ROUND(FHMargin, 2),
+                ROUND(TakeOff, 2), ROUND(TakeOffMargin, 2),
+                ROUND(ADOS, 2),
+                ROUND(ADIS, 2),
+                ROUND(FH / (ADIS * 24), 2), ROUND(FHMargin / (ADIS * 24), 2),
+                ROUND(TakeOff / ADIS, 2), ROUND(TakeOffMargin / ADIS, 2),
+                100 * ROUND(DYR, 4), 100 * ROUND(DYRMargin, 4),
+                100 * ROUND(CNR, 4), 100 * ROUND(CNRMargin, 4)
+            FROM kpis
+            ORDER BY Manufacturer, Period;
+            """).fetchall()
+        return self._decode_manufacturers(result)
+
+    def approximate_reporting(self, granularity='year', sample_percent=DEFAULT_SAMPLE_PERCENT, confidence=0.95, seed=None):
+        """
+        Estimació de RRh i RRc per fabricant i any o mes: informes exactes (fets mensuals) sobre FH i cicles estimats
+        El marge relatiu de cada taxa és el de l'estimació de FH (RRh) o de cicles (RRc)
+        Files: (fabricant, període, blocs mostrejats, exacte, RRh, ±, RRc, ±)
+        """
+        estimates, month_divisor = self._sampled_estimates_sql(granularity, sample_percent, confidence, seed)
+        ms_from, ms_manufacturer = self._manufacturer_source('MonthlyAircraftSummary', 'ms')
+        mmr_from, mmr_manufacturer = self._manufacturer_source('MonthlyMaintenanceReports', 'mmr')
+        result = self.conn_duckdb.execute(f"""
+            WITH {estimates},
+                reports AS (
+                    SELECT Manufacturer, Period, CAST(SUM(counter) AS DOUBLE) AS reports
+                    FROM (
+                        SELECT {ms_manufacturer} AS Manufacturer, ms.MonthKey // {month_divisor} AS Period, ms.PilotReportCount AS counter
+                        FROM {ms_from}
+                        UNION ALL
+                        SELECT {mmr_manufacturer} AS Manufacturer, mmr.MonthKey // {month_divisor} AS Period, mmr.MaintenanceReportCount AS counter
+                        FROM {mmr_from}
+                    )
+                    GROUP BY ALL
+                ),
+                rates AS (
+                    SELECT
+                        e.Manufacturer,
+                        e.Period,
+                        e.sampledBlocks,
+                        e.exact,
+                        r.reports / e.flightHours AS RRh,
+                        r.reports / e.flightHours * e.flightHoursMargin / e.flightHours AS RRhMargin,
+                        r.reports / e.flightCycles AS RRc,
+                        r.reports / e.flightCycles * e.flightCyclesMargin / e.flightCycles AS RRcMargin
+                    FROM estimates e
+                    JOIN reports r USING (Manufacturer, Period)
+                )
+            SELECT
+                Manufacturer,
+                Period,
+                sampledBlocks,
+                exact,
+                1000 * ROUND(RRh, 3), 1000 * ROUND(RRhMargin, 3),
+                100 * ROUND(RRc, 2), 100 * ROUND(RRcMargin, 2)
+            FROM rates
+            ORDER BY Manufacturer, Period;
+            """).fetchall()
+        return self._decode_manufacturers(result)
 
     # TODO: Rewrite the queries exemplified in "extract.py"
-    def query_utilization(self):
-        result = self.conn_duckdb.execute("""
+    def utilization_sql(self):
+        du_from, du_manufacturer, du_year = self._fact_source('DailyUtilization', 'du')
+        ms_from, ms_manufacturer, ms_year = self._fact_source('MonthlyAircraftSummary', 'ms')
+        return f"""
             WITH atomic_data AS (
                 SELECT
-                    a.AircraftManufacturer,
-                    d.Year,
-                    a.AircraftKey,
+                    {du_manufacturer} AS AircraftManufacturer,
+                    {du_year} AS Year,
+                    du.AircraftKey,
                     du.FlightHours,
                     du.FlightCycles,
                     du.NumberOfCancellations,
@@ -143,16 +474,14 @@ class DW:
                     du.SumOfDelayDuration,
                     CAST(0 AS DECIMAL(10,2)) AS scheduledOutOfService,
                     CAST(0 AS DECIMAL(10,2)) AS unScheduledOutOfService
-                FROM DailyUtilization du
-                JOIN Date d ON du.DateKey = d.DateKey
-                JOIN Aircraft a ON du.AircraftKey = a.AircraftKey
+                FROM {du_from}
                 
                 UNION ALL
 
                 SELECT
-                    a.AircraftManufacturer,
-                    m.Year,
-                    a.AircraftKey,
+                    {ms_manufacturer} AS AircraftManufacturer,
+                    {ms_year} AS Year,
+                    ms.AircraftKey,
                     0 AS FlightHours,
                     0 AS FlightCycles,
                     0 AS NumberOfCancellations,
@@ -160,9 +489,12 @@ class DW:
                     0 AS SumOfDelayDuration,
                     ms.ADOSS AS scheduledOutOfService,
                     ms.ADOSU AS unScheduledOutOfService
-                FROM MonthlyAircraftSummary ms
-                JOIN Month m ON ms.MonthKey = m.MonthKey
-                JOIN Aircraft a ON ms.AircraftKey = a.AircraftKey
+                FROM {ms_from}
+            ),
+            Periods AS ( -- Durada real de cada any: dies coberts per l'extracció (anys parcials i de traspàs)
+                SELECT Year, SUM(CoveredDays) AS PeriodDays
+                FROM Month
+                GROUP BY Year
             )
             SELECT
                 a.AircraftManufacturer,
@@ -172,52 +504,53 @@ class DW:
                 ROUND(SUM(a.scheduledOutOfService)/COUNT(DISTINCT a.AircraftKey), 2) AS ADOSS,
                 ROUND(SUM(a.unScheduledOutOfService)/COUNT(DISTINCT a.AircraftKey), 2) AS ADOSU,
                 ROUND((SUM(a.scheduledOutOfService)+SUM(a.unScheduledOutOfService))/COUNT(DISTINCT a.AircraftKey), 2) AS ADOS,
-                365-ROUND((SUM(a.scheduledOutOfService)+SUM(a.unScheduledOutOfService))/COUNT(DISTINCT a.AircraftKey), 2) AS ADIS,
-                ROUND( (ROUND(SUM(a.FlightHours)/COUNT(DISTINCT a.AircraftKey), 2)) / ((365-ROUND((SUM(a.scheduledOutOfService)+SUM(a.unScheduledOutOfService))/COUNT(DISTINCT a.AircraftKey), 2)) * 24), 2) AS DU,
-                ROUND( (ROUND(SUM(a.FlightCycles)/COUNT(DISTINCT a.AircraftKey), 2)) / (365-ROUND((SUM(a.scheduledOutOfService)+SUM(a.unScheduledOutOfService))/COUNT(DISTINCT a.AircraftKey), 2)), 2) AS DC,
+                p.PeriodDays-ROUND((SUM(a.scheduledOutOfService)+SUM(a.unScheduledOutOfService))/COUNT(DISTINCT a.AircraftKey), 2) AS ADIS,
+                ROUND( (ROUND(SUM(a.FlightHours)/COUNT(DISTINCT a.AircraftKey), 2)) / ((p.PeriodDays-ROUND((SUM(a.scheduledOutOfService)+SUM(a.unScheduledOutOfService))/COUNT(DISTINCT a.AircraftKey), 2)) * 24), 2) AS DU,
+                ROUND( (ROUND(SUM(a.FlightCycles)/COUNT(DISTINCT a.AircraftKey), 2)) / (p.PeriodDays-ROUND((SUM(a.scheduledOutOfService)+SUM(a.unScheduledOutOfService))/COUNT(DISTINCT a.AircraftKey), 2)), 2) AS DC,
                 100*ROUND(SUM(a.NumberOfDelays)/SUM(a.FlightCycles), 4) AS DYR,
                 100*ROUND(SUM(a.NumberOfCancellations)/SUM(a.FlightCycles), 4) AS CNR,
                 100-ROUND(100*(SUM(a.NumberOfDelays)+SUM(a.NumberOfCancellations))/SUM(a.FlightCycles), 2) AS TDR,
                 100*ROUND(SUM(a.SumOfDelayDuration)/SUM(a.NumberOfDelays),2) AS ADD
             FROM atomic_data a
-            GROUP BY a.AircraftManufacturer, a.Year
+            JOIN Periods p ON a.Year = p.Year
+            GROUP BY a.AircraftManufacturer, a.Year, p.PeriodDays
             ORDER BY a.AircraftManufacturer, a.Year;
-            """).fetchall()
-        return result
+            """
 
-    def query_reporting(self):
-        result = self.conn_duckdb.execute("""
+    def query_utilization(self):
+        result = self.conn_duckdb.execute(self.utilization_sql()).fetchall()
+        return self._decode_manufacturers(result)
+
+    def reporting_sql(self):
+        du_from, du_manufacturer, du_year = self._fact_source('DailyUtilization', 'du')
+        ms_from, ms_manufacturer, ms_year = self._fact_source('MonthlyAircraftSummary', 'ms')
+        mmr_from, mmr_manufacturer, mmr_year = self._fact_source('MonthlyMaintenanceReports', 'mmr')
+        return f"""
             WITH 
                 UtilizationData AS (
                     SELECT
-                        d.Year,
-                        a.AircraftManufacturer,
+                        {du_year} AS Year,
+                        {du_manufacturer} AS AircraftManufacturer,
                         SUM(du.FlightHours) AS flightHours,
                         SUM(du.FlightCycles) AS flightCycles
-                    FROM DailyUtilization du
-                    JOIN Date d ON du.DateKey = d.DateKey
-                    JOIN Aircraft a ON du.AircraftKey = a.AircraftKey
-                    GROUP BY d.Year, a.AircraftManufacturer
+                    FROM {du_from}
+                    GROUP BY ALL
                 ),
                 MaintReports AS (
                     SELECT
-                        m.Year,
-                        a.AircraftManufacturer,
+                        {mmr_year} AS Year,
+                        {mmr_manufacturer} AS AircraftManufacturer,
                         SUM(mmr.MaintenanceReportCount) as MaintCount
-                    FROM MonthlyMaintenanceReports mmr
-                    JOIN Month m ON mmr.MonthKey = m.MonthKey
-                    JOIN Aircraft a ON mmr.AircraftKey = a.AircraftKey
-                    GROUP BY m.Year, a.AircraftManufacturer
+                    FROM {mmr_from}
+                    GROUP BY ALL
                 ),
                 PilotReports AS (
                     SELECT
-                        m.Year,
-                        a.AircraftManufacturer,
+                        {ms_year} AS Year,
+                        {ms_manufacturer} AS AircraftManufacturer,
                         SUM(ms.PilotReportCount) as PilotCount
-                    FROM MonthlyAircraftSummary ms
-                    JOIN Month m ON ms.MonthKey = m.MonthKey
-                    JOIN Aircraft a ON ms.AircraftKey = a.AircraftKey
-                    GROUP BY m.Year, a.AircraftManufacturer
+                    FROM {ms_from}
+                    GROUP BY ALL
                 ),
                 TotalReports AS (
                     SELECT 
@@ -235,44 +568,44 @@ class DW:
             FROM TotalReports tr
             JOIN UtilizationData u ON tr.AircraftManufacturer = u.AircraftManufacturer AND tr.Year = u.Year
             ORDER BY tr.AircraftManufacturer, tr.Year;
-            """).fetchall()
-        return result
+            """
 
-    def query_reporting_per_role(self):
-        result = self.conn_duckdb.execute("""
+    def query_reporting(self):
+        result = self.conn_duckdb.execute(self.reporting_sql()).fetchall()
+        return self._decode_manufacturers(result)
+
+    def reporting_per_role_sql(self):
+        du_from, du_manufacturer, du_year = self._fact_source('DailyUtilization', 'du')
+        ms_from, ms_manufacturer, ms_year = self._fact_source('MonthlyAircraftSummary', 'ms')
+        mmr_from, mmr_manufacturer, mmr_year = self._fact_source('MonthlyMaintenanceReports', 'mmr')
+        return f"""
             WITH 
                 UtilizationData AS (
                     SELECT
-                        d.Year,
-                        a.AircraftManufacturer,
+                        {du_year} AS Year,
+                        {du_manufacturer} AS AircraftManufacturer,
                         SUM(du.FlightHours) AS flightHours,
                         SUM(du.FlightCycles) AS flightCycles
-                    FROM DailyUtilization du
-                    JOIN Date d ON du.DateKey = d.DateKey
-                    JOIN Aircraft a ON du.AircraftKey = a.AircraftKey
-                    GROUP BY d.Year, a.AircraftManufacturer
+                    FROM {du_from}
+                    GROUP BY ALL
                 ),
                 PilotReports AS (
                     SELECT
-                        m.Year,
-                        a.AircraftManufacturer,
+                        {ms_year} AS Year,
+                        {ms_manufacturer} AS AircraftManufacturer,
                         'PIREP' as role,
                         SUM(ms.PilotReportCount) as counter
-                    FROM MonthlyAircraftSummary ms
-                    JOIN Month m ON ms.MonthKey = m.MonthKey
-                    JOIN Aircraft a ON ms.AircraftKey = a.AircraftKey
-                    GROUP BY m.Year, a.AircraftManufacturer
+                    FROM {ms_from}
+                    GROUP BY ALL
                 ),
                 MaintReports AS (
                     SELECT
-                        m.Year,
-                        a.AircraftManufacturer,
+                        {mmr_year} AS Year,
+                        {mmr_manufacturer} AS AircraftManufacturer,
                         'MAREP' as role,
                         SUM(mmr.MaintenanceReportCount) as counter
-                    FROM MonthlyMaintenanceReports mmr
-                    JOIN Month m ON mmr.MonthKey = m.MonthKey
-                    JOIN Aircraft a ON mmr.AircraftKey = a.AircraftKey
-                    GROUP BY m.Year, a.AircraftManufacturer
+                    FROM {mmr_from}
+                    GROUP BY ALL
                 ),
                 CombinedReports AS (
                     SELECT * FROM PilotReports
@@ -288,9 +621,409 @@ class DW:
             FROM CombinedReports cr
             JOIN UtilizationData u ON u.AircraftManufacturer = cr.AircraftManufacturer AND u.Year = cr.Year
             ORDER BY cr.AircraftManufacturer, cr.Year, cr.role;
+            """
+
+    def query_reporting_per_role(self):
+        result = self.conn_duckdb.execute(self.reporting_per_role_sql()).fetchall()
+        return self._decode_manufacturers(result)
+
+
+class DW(DWQueries):
+    def __init__(self, create=False, physical_design='constrained', filename=duckdb_filename, wide_facts=False, resume=False,
+                 storage_layout='default'):
+        """
+        Blue/green: create=True (o resume=True) construeix el DW a build_filename(filename) sense tocar el DW publicat,
+        que continua servint consultes (query_service.py); close() el valida, l'optimitza i el publica atòmicament
+        storage_layout: tipus, compressió i format de les taules de fets (STORAGE_LAYOUTS); en reprendre cal passar el mateix
+        """
+        if physical_design not in PHYSICAL_DESIGNS:
+            raise ValueError(f"Unknown physical design '{physical_design}' (expected one of {PHYSICAL_DESIGNS})")
+        if storage_layout not in STORAGE_LAYOUTS:
+            raise ValueError(f"Unknown storage layout '{storage_layout}' (expected one of {tuple(STORAGE_LAYOUTS)})")
+        self.physical_design = physical_design
+        self.storage_layout = storage_layout
+        self.publish_to = filename if create or resume else None
+        self.filename = build_filename(filename) if self.publish_to else filename
+
+        if create:
+            # Construcció nova: es descarta qualsevol construcció anterior a mig fer
+            for stale_file in (self.filename, f"{self.filename}.wal"):
+                if os.path.exists(stale_file):
+                    os.remove(stale_file)
+        try:
+            self.conn_duckdb = duckdb.connect(self.filename)
+            compression = STORAGE_LAYOUTS[storage_layout]['compression']
+            if compression != 'auto':
+                self.conn_duckdb.execute(f"SET force_compression = '{compression}'")
+            print("Connection to the DW created successfully")
+        except duckdb.Error as e:
+            print(f"Unable to connect to DuckDB database '{self.filename}':", e)
+            sys.exit(1)
+
+        if create:
+            try:
+                # TODO: Create the tables in the DW
+                constraints = {
+                    table: ',' + ddl if physical_design == 'constrained' else ''
+                    for table, ddl in FACT_CONSTRAINTS.items()
+                }
+                wide_columns = '''
+                        Year SMALLINT,
+                        ManufacturerCode UTINYINT,''' if wide_facts else ''
+                integers = INTEGER_TYPES[STORAGE_LAYOUTS[storage_layout]['integers']]
+                measure = MEASURE_TYPES[STORAGE_LAYOUTS[storage_layout]['measures']]
+                self.conn_duckdb.execute(f'''
+                    CREATE TABLE Date (
+                        DateKey INT PRIMARY KEY,
+                        FullDate VARCHAR(10),
+                        Day INT,
+                        Month INT,
+                        Year INT,
+                        ISOYear INT,
+                        ISOWeek INT
+                    );
+
+                    CREATE TABLE Month (
+                        MonthKey INT PRIMARY KEY,
+                        Month INT,
+                        Year INT,
+                        DaysInMonth INT,
+                        CoveredDays INT
+                    );
+
+                    CREATE TABLE Aircraft (
+                        AircraftKey {integers['AircraftKey']} PRIMARY KEY,
+                        AircraftRegistrationCode VARCHAR(10),
+                        AircraftModel VARCHAR(30),
+                        AircraftManufacturer VARCHAR(30)
+                    );
+
+                    CREATE TABLE Manufacturer (
+                        ManufacturerCode UTINYINT PRIMARY KEY,
+                        AircraftManufacturer VARCHAR(30)
+                    );
+
+                    CREATE TABLE DailyUtilization (
+                        DateKey INT,
+                        AircraftKey {integers['AircraftKey']},{wide_columns}
+                        FlightHours {measure},
+                        FlightCycles {integers['DailyCount']},
+                        NumberOfDelays {integers['DailyCount']},
+                        NumberOfCancellations {integers['DailyCount']},
+                        SumOfDelayDuration INT{constraints['DailyUtilization']}
+                    );
+
+                    CREATE TABLE MonthlyAircraftSummary (
+                        MonthKey INT,
+                        AircraftKey {integers['AircraftKey']},{wide_columns}
+                        ADIS {measure},
+                        ADOSS {measure},
+                        ADOSU {measure},
+                        PilotReportCount {integers['MonthlyCount']}{constraints['MonthlyAircraftSummary']}
+                    );
+
+                    CREATE TABLE MonthlyMaintenanceReports (
+                        MonthKey INT,
+                        AircraftKey {integers['AircraftKey']},{wide_columns}
+                        AirportCode VARCHAR(4),
+                        MaintenanceReportCount {integers['MonthlyCount']}{constraints['MonthlyMaintenanceReports']}
+                    );
+
+                    CREATE TABLE ETLCheckpoint (
+                        Step VARCHAR(40) PRIMARY KEY,
+                        LoadedRows INT,
+                        CompletedAt TIMESTAMP
+                    );
+
+                    CREATE TABLE RejectionSummary (
+                        Step VARCHAR(40),
+                        Source VARCHAR(40),
+                        Reason VARCHAR(40),
+                        RejectedRows INT,
+                        PRIMARY KEY (Step, Source, Reason)
+                    );
+                    ''')
+                print("[dw.py] S'han creat les taules correctament")
+            except duckdb.Error as e:
+                print("[dw.py] Error creant les taules:", e)
+                sys.exit(2)
+
+        DWQueries.__init__(self, self.conn_duckdb)
+        self._manufacturer_codes = None # AircraftKey -> ManufacturerCode
+
+        # Link DuckDB and pygrametl (només es carrega per construir el DW, no per consultar-lo)
+        import pygrametl # https://pygrametl.org
+        from pygrametl.tables import CachedDimension, FactTable
+        self.conn_pygrametl = pygrametl.ConnectionWrapper(self.conn_duckdb)
+
+        # ======================================================================================================= Dimension and fact table objects
+        # TODO: Declare the dimensions and facts for pygrametl
+        self.date_dim = CachedDimension(
+            targetconnection=self.conn_pygrametl,
+            name='Date',
+            key='DateKey',
+            attributes=('FullDate', 'Day', 'Month', 'Year', 'ISOYear', 'ISOWeek'),
+            lookupatts=('DateKey',)
+        )
+
+        self.month_dim = CachedDimension(
+            targetconnection=self.conn_pygrametl,
+            name='Month',
+            key='MonthKey',
+            attributes=('Month', 'Year', 'DaysInMonth', 'CoveredDays'),
+            lookupatts=('MonthKey',)
+        )
+
+        self.aircraft_dim = CachedDimension(
+            targetconnection=self.conn_pygrametl,
+            name='Aircraft',
+            key='AircraftKey',
+            attributes=('AircraftRegistrationCode', 'AircraftModel', 'AircraftManufacturer'),
+            lookupatts=('AircraftRegistrationCode',)
+        )
+
+        wide_attributes = WIDE_FACT_ATTRIBUTES if self.wide_facts else ()
+
+        self.daily_utilization_fact = FactTable(
+            targetconnection=self.conn_pygrametl,
+            name='DailyUtilization',
+            keyrefs=('DateKey', 'AircraftKey'),
+            measures=('FlightHours', 'FlightCycles', 'NumberOfDelays', 'NumberOfCancellations', 'SumOfDelayDuration') + wide_attributes
+        )
+
+        self.monthly_summary_fact = FactTable(
+            targetconnection=self.conn_pygrametl,
+            name='MonthlyAircraftSummary',
+            keyrefs=('MonthKey', 'AircraftKey'),
+            measures=('ADIS', 'ADOSS', 'ADOSU', 'PilotReportCount') + wide_attributes
+        )
+
+        self.monthly_maintenance_reports_fact = FactTable(
+            targetconnection=self.conn_pygrametl,
+            name='MonthlyMaintenanceReports',
+            keyrefs=('MonthKey', 'AircraftKey', 'AirportCode'),
+            measures=('MaintenanceReportCount',) + wide_attributes
+        )
+
+    # ======================================================================================================= Layout ample
+    def _load_manufacturer_codes(self):
+        """
+        Codis compactes de fabricant (ordenats per nom perquè l'ORDER BY pel codi coincideixi amb l'ORDER BY pel nom)
+        """
+        if self.conn_duckdb.execute("SELECT COUNT(*) FROM Manufacturer").fetchone()[0] == 0:
+            self.conn_duckdb.execute("""
+                INSERT INTO Manufacturer
+                SELECT ROW_NUMBER() OVER (ORDER BY AircraftManufacturer) - 1, AircraftManufacturer
+                FROM (SELECT DISTINCT AircraftManufacturer FROM Aircraft)
+                """)
+        rows = self.conn_duckdb.execute("""
+            SELECT a.AircraftKey, m.ManufacturerCode, m.AircraftManufacturer
+            FROM Aircraft a JOIN Manufacturer m ON a.AircraftManufacturer = m.AircraftManufacturer
+            """).fetchall()
+        self._manufacturer_codes = {aircraft_key: code for aircraft_key, code, _ in rows}
+        self._manufacturer_names = {code: name for _, code, name in rows}
+
+    def denormalized_attributes(self, aircraft_key, year):
+        """
+        Atributs desnormalitzats d'una fila de fets, a partir de les dimensions en memòria
+        """
+        if self._manufacturer_codes is None:
+            self._load_manufacturer_codes()
+        return {'Year': year, 'ManufacturerCode': self._manufacturer_codes[aircraft_key]}
+
+    # ======================================================================================================= Batches i checkpoints
+    def begin_batch(self):
+        """
+        Obre una transacció al cursor de pygrametl (sense això cada insert és una transacció)
+        """
+        self.conn_pygrametl.execute('BEGIN TRANSACTION')
+
+    def commit_batch(self):
+        self.conn_pygrametl.execute('COMMIT')
+
+    def is_step_completed(self, step):
+        result = self.conn_duckdb.execute(
+            "SELECT COUNT(*) FROM ETLCheckpoint WHERE Step = ?", [step]
+        ).fetchone()
+        return result[0] > 0
+
+    def mark_step_completed(self, step, loaded_rows, rejections=()):
+        """
+        Marca el pas com a completat i desa, en la mateixa transacció, el recompte dels rebuigs produïts pel pas
+        (rejections.RejectionSink.step_summary()): en reprendre l'ETL un pas completat ja no es torna a netejar
+        """
+        self.conn_duckdb.execute("BEGIN TRANSACTION")
+        self.conn_duckdb.execute(
+            "INSERT OR REPLACE INTO ETLCheckpoint VALUES (?, ?, current_localtimestamp())", [step, loaded_rows]
+        )
+        for source, reason, rejected_rows in rejections:
+            self.conn_duckdb.execute(
+                "INSERT OR REPLACE INTO RejectionSummary VALUES (?, ?, ?, ?)", [step, source, reason, rejected_rows]
+            )
+        self.conn_duckdb.execute("COMMIT")
+
+    def rejection_summary(self):
+        """
+        Rebuigs de tota la construcció (també els de les execucions anteriors si s'ha reprès): (source, reason, files)
+        """
+        return self.conn_duckdb.execute("""
+            SELECT Source, Reason, SUM(RejectedRows)
+            FROM RejectionSummary
+            GROUP BY Source, Reason
+            ORDER BY Source, Reason
             """).fetchall()
-        return result
+
+    def reset_step(self, table_name):
+        """
+        Elimina les files d'una càrrega de fets que no va acabar (batches ja confirmats)
+        """
+        self.conn_duckdb.execute(f"DELETE FROM {table_name}")
+
+    # ======================================================================================================= Disseny físic
+    def finalize_physical_design(self):
+        """
+        Aplica el disseny físic un cop carregats els fets: ordena les taules i, si cal, crea els índexs
+        """
+        if self.physical_design == 'constrained':
+            return
+        self.conn_pygrametl.commit()
+        for table, sort_key in FACT_SORT_KEYS.items():
+            columns = ', '.join(sort_key)
+            self.conn_duckdb.execute(f'''
+                CREATE TABLE {table}_sorted AS SELECT * FROM {table} ORDER BY {columns};
+                DROP TABLE {table};
+                ALTER TABLE {table}_sorted RENAME TO {table};
+                ''')
+            if self.physical_design == 'indexed':
+                # Índex únic: també valida la clau primària que no s'ha comprovat durant la càrrega
+                self.conn_duckdb.execute(f"CREATE UNIQUE INDEX {table}_pk_idx ON {table} ({columns})")
+                self.conn_duckdb.execute(f"CREATE INDEX {table}_aircraft_idx ON {table} (AircraftKey)")
+        print(f"[dw.py] Disseny físic '{self.physical_design}' aplicat")
+
+    # ======================================================================================================= Publicació
+    def check_integrity(self):
+        """
+        Comprova el DW construït abans de publicar-lo. Retorna la llista de problemes trobats (buida si és correcte)
+        Amb els dissenys sense restriccions és l'única validació de claus primàries i foranes
+        """
+        problems = []
+        if self.conn_duckdb.execute("SELECT COUNT(*) FROM DailyUtilization").fetchone()[0] == 0:
+            problems.append("DailyUtilization is empty")
+
+        for table, key in FACT_SORT_KEYS.items():
+            columns = ', '.join(key)
+            duplicates = self.conn_duckdb.execute(f"""
+                SELECT COUNT(*) FROM (SELECT {columns} FROM {table} GROUP BY {columns} HAVING COUNT(*) > 1)
+                """).fetchone()[0]
+            if duplicates:
+                problems.append(f"{table}: {duplicates} duplicated keys ({columns})")
+
+            period_key, period_table = ('DateKey', 'Date') if 'DateKey' in key else ('MonthKey', 'Month')
+            for foreign_key, dimension in ((period_key, period_table), ('AircraftKey', 'Aircraft')):
+                orphans = self.conn_duckdb.execute(f"""
+                    SELECT COUNT(*) FROM {table} f
+                    WHERE f.{foreign_key} IS NULL OR NOT EXISTS (SELECT 1 FROM {dimension} d WHERE d.{foreign_key} = f.{foreign_key})
+                    """).fetchone()[0]
+                if orphans:
+                    problems.append(f"{table}: {orphans} rows without a matching {dimension}")
+        return problems
+
+    def publish(self):
+        """
+        Construeix DailyCumulative, valida, optimitza (ANALYZE, CHECKPOINT) i mou atòmicament el DW construït al seu lloc definitiu
+        Si la validació falla, el DW publicat no es toca i la construcció es conserva per inspeccionar-la o reprendre-la
+        Cost de DailyCumulative a cada construcció: una fila per aeronau i dia del calendari dens (també els dies sense
+        vols) i les sumes acumulades comprimeixen pitjor que els fets. Amb 4,7 M de files diàries ocupa 134 blocs contra
+        114 de DailyUtilization i triga ~23 s amb un fil (la finestra és la major part)
+        """
+        self.conn_pygrametl.commit()
+        if not self.is_step_completed('DailyCumulative'):
+            # Les finestres mòbils (KPIEngine.rolling) en depenen i el DW publicat només s'obre en lectura
+            KPIEngine(self).refresh_cumulative()
+            cumulative_rows = self.conn_duckdb.execute("SELECT COUNT(*) FROM DailyCumulative").fetchone()[0]
+            self.mark_step_completed('DailyCumulative', cumulative_rows)
+        problems = self.check_integrity()
+        if problems:
+            self.conn_pygrametl.close()
+            print(f"[dw.py] No es publica '{self.filename}', la validació ha fallat:")
+            for problem in problems:
+                print(f"    - {problem}")
+            sys.exit(3)
+
+        parquet_files = self._move_facts_to_parquet() if STORAGE_LAYOUTS[self.storage_layout]['parquet'] else []
+        self.conn_duckdb.execute("ANALYZE") # Estadístiques per l'optimitzador
+        self.conn_duckdb.execute("CHECKPOINT") # Tot el WAL dins del fitxer abans de moure'l
+        if parquet_files:
+            # DuckDB no allibera l'espai de les taules eliminades: es publica una còpia compacta (vistes i claus incloses)
+            compact_filename = f"{self.filename}.compact"
+            if os.path.exists(compact_filename):
+                os.remove(compact_filename)
+            database = self.conn_duckdb.execute("SELECT current_database()").fetchone()[0]
+            escaped_compact = compact_filename.replace("'", "''")
+            self.conn_duckdb.execute(f"ATTACH '{escaped_compact}' AS compact")
+            self.conn_duckdb.execute(f'COPY FROM DATABASE "{database}" TO compact')
+            self.conn_duckdb.execute("DETACH compact")
+        self.conn_pygrametl.close()
+        if parquet_files:
+            os.replace(compact_filename, self.filename)
+        previous_files = self._published_parquet_files()
+        os.replace(self.filename, self.publish_to) # Atòmic: els lectors veuen la versió anterior o la nova
+        print(f"[dw.py] DW publicat a '{self.publish_to}'")
+        if previous_files is not None:
+            self._remove_retired_parquet(set(parquet_files) | previous_files)
+
+    def _published_parquet_files(self):
+        """
+        Fitxers Parquet que fan servir les vistes del DW publicat fins ara (buit si no n'hi ha o no té el layout parquet)
+        None si no es pot llegir: llavors no s'esborra cap fitxer
+        """
+        if not os.path.exists(self.publish_to):
+            return set()
+        try:
+            conn = duckdb.connect(self.publish_to, read_only=True)
+            try:
+                views = conn.execute("SELECT sql FROM duckdb_views() WHERE NOT internal").fetchall()
+            finally:
+                conn.close()
+        except duckdb.Error:
+            return None
+        return {
+            parquet_file.replace("''", "'")
+            for (sql,) in views for parquet_file in re.findall(r"read_parquet\('((?:[^']|'')*)'", sql)
+        }
+
+    def _remove_retired_parquet(self, kept_files):
+        """
+        Esborra els fitxers Parquet del DW publicat que no són de la publicació actual ni de l'anterior (els lectors que
+        encara tenen obert el DW anterior en depenen), sigui quin sigui el layout de cada publicació
+        """
+        for parquet_file in glob.glob(f"{glob.escape(os.path.abspath(self.publish_to))}.*.parquet"):
+            if parquet_file not in kept_files:
+                os.remove(parquet_file)
+
+    def _move_facts_to_parquet(self):
+        """
+        Layout parquet: copia cada taula de fets a un fitxer Parquet (zstd) al costat del DW publicat i la substitueix
+        per una vista. Els fitxers porten un identificador de construcció perquè els lectors del DW anterior no es
+        quedin sense dades en publicar; retorna la llista de fitxers creats
+        """
+        build_id = time.time_ns()
+        parquet_files = []
+        for table in FACT_SORT_KEYS:
+            parquet_file = os.path.abspath(f"{self.publish_to}.{table}.{build_id}.parquet")
+            escaped_file = parquet_file.replace("'", "''")
+            self.conn_duckdb.execute(f"COPY {table} TO '{escaped_file}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+            self.conn_duckdb.execute(f"DROP TABLE {table}")
+            self.conn_duckdb.execute(
+                f"CREATE VIEW {table} AS SELECT * FROM read_parquet('{escaped_file}', file_row_number = true)"
+            )
+            parquet_files.append(parquet_file)
+        self.conn_pygrametl.commit()
+        return parquet_files
 
     def close(self):
+        if self.publish_to is not None:
+            self.publish()
+            return
         self.conn_pygrametl.commit()
-        self.conn_pygrametl.close()
\ No newline at end of file
+        self.conn_pygrametl.close()
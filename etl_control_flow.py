@@ -1,37 +1,73 @@
-from dw import DW
+from dw import DW, duckdb_filename, build_filename, PHYSICAL_DESIGNS, STORAGE_LAYOUTS
 import extract
-import transform
 import load
+from rejections import RejectionSink, REJECTION_FORMATS, default_rejections_filename
 from itertools import tee # Clonar iteradors fonts de dades
-import pandas as pd
+import argparse
 import os
 
-# Netejar cleaning.log si tornem a executar
-if os.path.exists('cleaning.log'):
-    with open('cleaning.log', 'w') as f:
-        f.write('')
+def load_dimension_step(dw, step, transformed_data, dimension_object, rejection_sink):
+    """
+    Carrega una dimensió en una sola transacció i la marca com a completada (amb els rebuigs produïts fins ara)
+    """
+    if dw.is_step_completed(step):
+        print(f"[resume] Es salta la dimensió {step} (ja carregada)")
+        return
+    dw.begin_batch()
+    load.load_dimension(transformed_data, dimension_object)
+    dw.commit_batch()
+    dw.mark_step_completed(step, len(transformed_data) if isinstance(transformed_data, list) else None,
+                           rejection_sink.step_summary())
+
+def load_fact_step(dw, step, load_function, transform_function, batch_size, rejection_sink):
+    """
+    Carrega una taula de fets per batches si no s'ha completat en una execució anterior
+    Si hi ha files d'una execució interrompuda, s'eliminen abans de tornar a carregar
+    """
+    if dw.is_step_completed(step):
+        print(f"[resume] Es salta la taula de fets {step} (ja carregada)")
+        return
+    dw.reset_step(step)
+    loaded_rows = load_function(dw, transform_function(), batch_size=batch_size)
+    dw.mark_step_completed(step, loaded_rows, rejection_sink.step_summary())
+
+def run_etl(resume=False, batch_size=load.DEFAULT_BATCH_SIZE, apply_cleaning=True, physical_design='constrained', wide_facts=False,
+            filename=duckdb_filename, br21_at_source=False, rejections_filename=default_rejections_filename,
+            rejections_format='jsonl', storage_layout='default'):
+    """
+    El DW es construeix en un fitxer a part i es publica a filename en acabar, sense aturar els lectors
+    resume: continua la construcció interrompuda (si n'hi ha) saltant els passos ja completats
+    br21_at_source: la font marca els candidats a BR-21 i la neteja només resol aquests vols
+    Els registres rebutjats per la neteja s'escriuen a rejections_filename (jsonl o parquet) i es resumeixen a RejectionSummary
+    amb el pas que els ha produït; en reprendre, el fitxer conserva els rebuigs dels passos completats
+    storage_layout: tipus, compressió i format de les taules de fets (dw.STORAGE_LAYOUTS)
+    """
+    import transform # pandas i tqdm només es carreguen quan s'executa l'ETL
+    resume = resume and os.path.exists(build_filename(filename))
+    dw = DW(create=not resume, resume=resume, physical_design=physical_design, wide_facts=wide_facts, filename=filename,
+            storage_layout=storage_layout)
+    print(f"{ 'SI' if apply_cleaning else 'NO'} estem netejant dades")
+    rejection_sink = RejectionSink(rejections_filename, rejections_format,
+                                   resume_rows=sum(rows for _, _, rows in dw.rejection_summary()) if resume else None)
 
-if __name__ == '__main__':
-    dw = DW(create=True)
-    APPLY_CLEANING = True # Netejar dades brutes
-    print(f"{ 'SI' if APPLY_CLEANING else 'NO'} estem netejant dades")
- 
     print("\n--- EXTRACCIÓ I CÀRREGA AIRCRAFT ---\n")
     # La carreguem primer per fer el cleaning de registres
     aircraft_info_source = extract.extract_aircraft_info_from_csv()
-    transformed_aircraft = transform.transform_aircraft_dimension(aircraft_info_source)
-    load.load_dimension(transformed_aircraft, dw.aircraft_dim)
+    transformed_aircraft = list(transform.transform_aircraft_dimension(aircraft_info_source))
+    load_dimension_step(dw, 'Aircraft', transformed_aircraft, dw.aircraft_dim, rejection_sink)
 
     print("\n--- EXTRACCIÓ DE LES ALTRES FONTS DE DADES ---\n")
     personnel_source = extract.extract_personnel_info_from_csv()
-    flights_source = extract.extract_flights_from_aims()
+    flights_source = extract.extract_flights_from_aims(flag_overlaps=br21_at_source and apply_cleaning)
     maintenance_source = extract.extract_maintenance_from_aims()
     reports_source = extract.extract_reports_from_amos()
 
-    # BR ValidAircraftRegistration
-    flights_source = transform.clean_invalid_aircraft(flights_source, dw)
-    maintenance_source = transform.clean_invalid_aircraft(maintenance_source, dw)
-    reports_source = transform.clean_invalid_aircraft(reports_source, dw)
+    # BR ValidAircraftRegistration: els rebuigs es produeixen en preparar Date, que consumeix les tres fonts
+    # Si Date ja es va completar, ja són al fitxer i a RejectionSummary
+    rejection_sink.recording = not dw.is_step_completed('Date')
+    flights_source = transform.clean_invalid_aircraft(flights_source, dw, rejection_sink, 'AIMS.flights')
+    maintenance_source = transform.clean_invalid_aircraft(maintenance_source, dw, rejection_sink, 'AIMS.maintenance')
+    reports_source = transform.clean_invalid_aircraft(reports_source, dw, rejection_sink, 'AMOS.postflightreports')
 
     print("\n--- TRANSFORMANT I CARREGANT DATE I MONTH ---\n")
 
@@ -41,26 +77,58 @@ if __name__ == '__main__':
 
     date_data, month_data, flights_for_facts, maint_for_facts, reports_filtered = transform.transform_date_dimensions(flights1, maint1, reports1)
 
-    load.load_dimension(date_data, dw.date_dim)
-    load.load_dimension(month_data, dw.month_dim)
+    load_dimension_step(dw, 'Date', date_data, dw.date_dim, rejection_sink)
+    rejection_sink.recording = True
+    load_dimension_step(dw, 'Month', month_data, dw.month_dim, rejection_sink)
 
     print("\n--- TRANSFORMANT I CARREGANT FETS ---\n")
 
     # Clonem font reports
     reports_for_summary, reports_for_maint = tee(reports_filtered, 2)
 
-    transformed_data = transform.transform_daily_utilization(flights_for_facts, apply_cleaning=APPLY_CLEANING)
-    load.load_daily_utilization(dw, transformed_data)
+    load_fact_step(dw, 'DailyUtilization', load.load_daily_utilization,
+                   lambda: transform.transform_daily_utilization(flights_for_facts, apply_cleaning=apply_cleaning,
+                                                                 rejection_sink=rejection_sink), batch_size, rejection_sink)
 
     print("\n")
 
-    transformed_data = transform.transform_monthly_summary(maint_for_facts, reports_for_summary)
-    load.load_monthly_summary(dw, transformed_data)
+    load_fact_step(dw, 'MonthlyAircraftSummary', load.load_monthly_summary,
+                   lambda: transform.transform_monthly_summary(maint_for_facts, reports_for_summary, month_data), batch_size,
+                   rejection_sink)
 
     print("\n")
 
-    transformed_data = transform.transform_monthly_maintenance_reports(reports_for_maint, personnel_source)
-    load.load_monthly_maintenance_reports(dw, transformed_data)
+    load_fact_step(dw, 'MonthlyMaintenanceReports', load.load_monthly_maintenance_reports,
+                   lambda: transform.transform_monthly_maintenance_reports(reports_for_maint, personnel_source), batch_size,
+                   rejection_sink)
+
+    if not dw.is_step_completed('PhysicalDesign'):
+        dw.finalize_physical_design()
+        dw.mark_step_completed('PhysicalDesign', None)
+
+    rejection_sink.close()
+    for source, reason, rejected_rows in dw.rejection_summary():
+        print(f"[rebuigs] {source} {reason}: {rejected_rows} registres")
 
     print("\nS'ha completat l'ETL")
-    dw.close()
\ No newline at end of file
+    dw.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="ETL de AIMS/AMOS cap al DW")
+    parser.add_argument('--resume', action='store_true', help="Reprèn l'ETL saltant els passos ja completats")
+    parser.add_argument('--batch-size', type=int, default=load.DEFAULT_BATCH_SIZE, help="Files per commit a les taules de fets")
+    parser.add_argument('--physical-design', choices=PHYSICAL_DESIGNS, default='constrained', help="Restriccions, ordenació i índexs de les taules de fets")
+    parser.add_argument('--wide-facts', action='store_true', help="Desa l'any i el fabricant a les taules de fets per evitar joins")
+    parser.add_argument('--storage-layout', choices=tuple(STORAGE_LAYOUTS), default='default', help="Tipus, compressió i format (DuckDB o Parquet) de les taules de fets")
+    parser.add_argument('--source', choices=extract.SOURCE_BACKENDS, default=extract.source_backend, help="Font de dades AIMS/AMOS")
+    parser.add_argument('--rejections-format', choices=REJECTION_FORMATS, default='jsonl', help="Format del fitxer de registres rebutjats")
+    parser.add_argument('--rejections-file', default=None, help="Fitxer de registres rebutjats (per defecte cleaning.jsonl o cleaning.parquet)")
+    parser.add_argument('--br21-at-source', action='store_true', help="Detecta els solapaments BR-21 a la font amb LAG/LEAD")
+    args = parser.parse_args()
+
+    extract.configure_source(args.source)
+
+    run_etl(resume=args.resume, batch_size=args.batch_size, apply_cleaning=True, # Netejar dades brutes
+            physical_design=args.physical_design, wide_facts=args.wide_facts, storage_layout=args.storage_layout,
+            br21_at_source=args.br21_at_source, rejections_format=args.rejections_format,
+            rejections_filename=args.rejections_file or f"cleaning.{args.rejections_format}")
@@ -1,9 +1,16 @@
+import csv
+import os
 from pathlib import Path
-import psycopg2
-import pandas as pd
 from itertools import tee # Per clonar iteradors (debugging)
-# https://pygrametl.org
-from pygrametl.datasources import CSVSource, SQLSource
+# pygrametl (https://pygrametl.org) es carrega al primer ús: les consultes baseline no el necessiten
+
+# Fonts de dades: PostgreSQL real (db_conf.txt) o una còpia local en DuckDB amb els esquemes AIMS i AMOS
+SOURCE_BACKENDS = ('postgres', 'duckdb')
+source_backend = os.environ.get('DW_SOURCE_BACKEND', 'postgres')
+source_filename = os.environ.get('DW_SOURCE_FILE', 'sources.duckdb')
+data_dir = Path(os.environ.get('DW_DATA_DIR', 'data'))
+
+conn = None # Es connecta al primer ús (get_connection)
 
 def debug_source(source, name=""):
     """
@@ -14,43 +21,113 @@ def debug_source(source, name=""):
     print(f"S'han extret {count} files de {name}")
     return source
 
-# Connect to the PostgreSQL source
-path = Path("db_conf.txt")
-if not path.is_file():
-    raise FileNotFoundError(f"Database configuration file '{path.absolute()}' not found.")
-try:
-    parameters = {}
-    # Read the database configuration from the provided txt file, line by line
-    with open(path, 'r') as f:
-        lines = f.readlines()
-        for line in lines:
-            parameters[line.split('=', 1)[0]] = line.split('=', 1)[1].strip()
-    conn = psycopg2.connect(
-        dbname=parameters['dbname'],
-        user=parameters['user'],
-        password=parameters['password'],
-        host=parameters['ip'],
-        port=parameters['port']
-    )
-except psycopg2.Error as e:
-    print(e)
-    raise ValueError(f"Unable to connect to the database: {parameters}")
-except Exception as e:
-    print(e)
-    raise ValueError(f"Database configuration file '{path.absolute()}' not properly formatted (check file 'db_conf.example.txt'.")
+def configure_source(backend, filename=None, data_directory=None):
+    """
+    Canvia la font de dades (tanca la connexió actual si n'hi ha)
+    """
+    global source_backend, source_filename, data_dir, conn
+    if backend not in SOURCE_BACKENDS:
+        raise ValueError(f"Unknown source backend '{backend}' (expected one of {SOURCE_BACKENDS})")
+    if conn is not None:
+        conn.close()
+        conn = None
+    source_backend = backend
+    if filename is not None:
+        source_filename = filename
+    if data_directory is not None:
+        data_dir = Path(data_directory)
+
+def connect_postgres():
+    """
+    Connect to the PostgreSQL source
+    """
+    import psycopg2
+
+    path = Path("db_conf.txt")
+    if not path.is_file():
+        raise FileNotFoundError(f"Database configuration file '{path.absolute()}' not found.")
+    try:
+        parameters = {}
+        # Read the database configuration from the provided txt file, line by line
+        with open(path, 'r') as f:
+            lines = f.readlines()
+            for line in lines:
+                parameters[line.split('=', 1)[0]] = line.split('=', 1)[1].strip()
+        return psycopg2.connect(
+            dbname=parameters['dbname'],
+            user=parameters['user'],
+            password=parameters['password'],
+            host=parameters['ip'],
+            port=parameters['port']
+        )
+    except psycopg2.Error as e:
+        print(e)
+        raise ValueError(f"Unable to connect to the database: {parameters}")
+    except Exception as e:
+        print(e)
+        raise ValueError(f"Database configuration file '{path.absolute()}' not properly formatted (check file 'db_conf.example.txt'.")
+
+def connect_duckdb():
+    """
+    Connect to the local DuckDB stand-in (see synthetic.generate_source_database)
+    """
+    import duckdb
+
+    path = Path(source_filename)
+    if not path.is_file():
+        raise FileNotFoundError(f"Source database '{path.absolute()}' not found (generate it with synthetic.generate_source_database).")
+    return duckdb.connect(str(path), read_only=True)
+
+def get_connection():
+    global conn
+    if conn is None:
+        conn = connect_postgres() if source_backend == 'postgres' else connect_duckdb()
+    return conn
 
 
 # TODO: Implement here all the extracting functions
 
-def extract_flights_from_aims():
+def extract_flights_from_aims(flag_overlaps=False):
     """
     S'extreuen les dades rellevants de flights de la base de dades AIMS
+    flag_overlaps: marca a la font els candidats a violar BR-21 (br21_candidate) amb LAG/LEAD per aeronau,
+    perquè la neteja només hagi de revisar aquests vols. Les hores s'intercanvien com BR-23 (una hora NULL no es toca) i
+    els vols s'ordenen igual que a transform.resolve_overlaps: sortida, arribada i sortida programada, amb els NULL al final
     """
-    query = """
-        SELECT aircraftregistration, scheduleddeparture, scheduledarrival, actualdeparture, actualarrival, cancelled
-        FROM "AIMS".flights
-    """
-    source = SQLSource(conn, query)
+    if flag_overlaps:
+        query = """
+            WITH ordered AS (
+                SELECT aircraftregistration, scheduleddeparture, scheduledarrival, actualdeparture, actualarrival, cancelled,
+                    CASE WHEN actualarrival < actualdeparture THEN actualarrival ELSE actualdeparture END AS fixeddeparture,
+                    CASE WHEN actualarrival < actualdeparture THEN actualdeparture ELSE actualarrival END AS fixedarrival
+                FROM "AIMS".flights
+            ),
+            neighbours AS (
+                SELECT *,
+                    ROW_NUMBER() OVER w AS br21_sequence,
+                    LAG(fixedarrival) OVER w AS previousarrival,
+                    LAG(cancelled) OVER w AS previouscancelled,
+                    LEAD(fixeddeparture) OVER w AS nextdeparture,
+                    LEAD(cancelled) OVER w AS nextcancelled
+                FROM ordered
+                WINDOW w AS (PARTITION BY aircraftregistration
+                             ORDER BY fixeddeparture NULLS LAST, fixedarrival NULLS LAST, scheduleddeparture)
+            )
+            SELECT aircraftregistration, scheduleddeparture, scheduledarrival, actualdeparture, actualarrival, cancelled,
+                br21_sequence,
+                COALESCE(NOT cancelled AND (
+                    (NOT previouscancelled AND previousarrival > fixeddeparture)
+                    OR (NOT nextcancelled AND fixedarrival > nextdeparture)
+                ), FALSE) AS br21_candidate
+            FROM neighbours
+        """
+    else:
+        query = """
+            SELECT aircraftregistration, scheduleddeparture, scheduledarrival, actualdeparture, actualarrival, cancelled
+            FROM "AIMS".flights
+        """
+    from pygrametl.datasources import SQLSource
+    source = SQLSource(get_connection(), query)
     return debug_source(source, name="AIMS.flights")
 
 def extract_maintenance_from_aims():
@@ -61,7 +138,8 @@ def extract_maintenance_from_aims():
         SELECT aircraftregistration, scheduleddeparture, scheduledarrival, programmed
         FROM "AIMS".maintenance
     """
-    source = SQLSource(conn, query)
+    from pygrametl.datasources import SQLSource
+    source = SQLSource(get_connection(), query)
     return debug_source(source, name="AIMS.maintenance")
 
 def extract_reports_from_amos():
@@ -72,15 +150,18 @@ def extract_reports_from_amos():
         SELECT aircraftregistration, reportingdate, reporteurid, reporteurclass
         FROM "AMOS".postflightreports
     """
-    source = SQLSource(conn, query)
+    from pygrametl.datasources import SQLSource
+    source = SQLSource(get_connection(), query)
     return debug_source(source, name="AMOS.postflightreports")
 
 def extract_aircraft_info_from_csv():
-    source = CSVSource(open('data/aircraft-manufacturerinfo-lookup.csv', 'r', encoding='utf-8'))
+    from pygrametl.datasources import CSVSource
+    source = CSVSource(open(data_dir / 'aircraft-manufacturerinfo-lookup.csv', 'r', encoding='utf-8'))
     return debug_source(source, name="aircraft-manufacturerinfo-lookup.csv")
 
 def extract_personnel_info_from_csv():
-    source = CSVSource(open('data/maintenance_personnel.csv', 'r', encoding='utf-8'))
+    from pygrametl.datasources import CSVSource
+    source = CSVSource(open(data_dir / 'maintenance_personnel.csv', 'r', encoding='utf-8'))
     return debug_source(source, name="maintenance_personnel.csv")
 
 
@@ -88,18 +169,17 @@ def extract_personnel_info_from_csv():
 # Baseline queries
 def get_aircrafts_per_manufacturer() -> dict[str, list[str]]:
     # TODO: Implement a function to generate a dictionary with one entry per manufacturer and a list of aircraft identifiers as values
-    df = pd.read_csv('data/aircraft-manufacturerinfo-lookup.csv')
-    df.rename(columns={'aircraft_reg_code': 'aircraftregistration'}, inplace=True)
+    # Amb csv de la llibreria estàndard: les consultes baseline no han de carregar pandas
     aircraft_dict = {}
-    for manufacturer, group in df.groupby('aircraft_manufacturer'):
-        aircraft_dict[manufacturer] = group['aircraftregistration'].tolist()
+    with open(data_dir / 'aircraft-manufacturerinfo-lookup.csv', 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            aircraft_dict.setdefault(row['aircraft_manufacturer'], []).append(row['aircraft_reg_code'])
     return aircraft_dict
 
 
-def query_utilization_baseline():
+def query_utilization_baseline_sql():
     aircrafts = get_aircrafts_per_manufacturer()
-    cur = conn.cursor()
-    cur.execute(f"""
+    return f"""
         WITH atomic_data AS (
             SELECT f.aircraftregistration,
                 CASE 
@@ -176,16 +256,20 @@ def query_utilization_baseline():
         FROM atomic_data a
         GROUP BY a.manufacturer, a.year
         ORDER BY a.manufacturer, a.year;
-        """)
+        """
+
+
+def query_utilization_baseline():
+    cur = get_connection().cursor()
+    cur.execute(query_utilization_baseline_sql())
     result = cur.fetchall()
     cur.close()
     return result
 
 
-def query_reporting_baseline():
+def query_reporting_baseline_sql():
     aircrafts = get_aircrafts_per_manufacturer()
-    cur = conn.cursor()
-    cur.execute(f"""
+    return f"""
         WITH 
             atomic_data_utilization AS (
                 SELECT
@@ -224,16 +308,20 @@ def query_reporting_baseline():
         FROM atomic_data_reporting f1
             JOIN atomic_data_utilization f2 ON f2.manufacturer = f1.manufacturer AND f1.year = f2.year
         ORDER BY f1.manufacturer, f1.YEAR;
-        """)
+        """
+
+
+def query_reporting_baseline():
+    cur = get_connection().cursor()
+    cur.execute(query_reporting_baseline_sql())
     result = cur.fetchall()
     cur.close()
     return result
 
 
-def query_reporting_per_role_baseline():
+def query_reporting_per_role_baseline_sql():
     aircrafts = get_aircrafts_per_manufacturer()
-    cur = conn.cursor()
-    cur.execute(f"""
+    return f"""
         WITH 
             atomic_data_utilization AS (
                 SELECT
@@ -273,7 +361,12 @@ def query_reporting_per_role_baseline():
         FROM atomic_data_reporting f1
             JOIN atomic_data_utilization f2 ON f2.manufacturer = f1.manufacturer AND f1.year = f2.year
         ORDER BY f1.manufacturer, f1.year, f1.role;
-        """)
+        """
+
+
+def query_reporting_per_role_baseline():
+    cur = get_connection().cursor()
+    cur.execute(query_reporting_per_role_baseline_sql())
     result = cur.fetchall()
     cur.close()
     return result
\ No newline at end of file
@@ -0,0 +1,204 @@
+"""
+Motor de KPIs sobre el DW a diferents granularitats (dia, setmana ISO, mes, any) i en finestres mòbils
+"""
+
+# Període de cada granularitat a partir de la dimensió Date (d) i Month (m)
+DATE_PERIODS = {
+    'day': 'd.DateKey',
+    'week': 'd.ISOYear * 100 + d.ISOWeek',
+    'month': 'd.Year * 100 + d.Month',
+    'year': 'd.Year',
+}
+
+# Els fets mensuals (fora de servei, informes) només es poden agregar a mes o any
+MONTH_PERIODS = {
+    'month': 'm.MonthKey',
+    'year': 'm.Year',
+}
+
+GROUPS = {
+    'manufacturer': 'a.AircraftManufacturer',
+    'model': 'a.AircraftModel',
+    'aircraft': 'a.AircraftRegistrationCode',
+}
+
+# Tipus de cada suma acumulada: SUM() els eixamplaria a HUGEINT/DECIMAL(38, 2) (16 bytes per valor)
+CUMULATIVE_MEASURES = {
+    'FlightHours': 'DECIMAL(18, 2)',
+    'FlightCycles': 'BIGINT',
+    'NumberOfDelays': 'BIGINT',
+    'NumberOfCancellations': 'BIGINT',
+    'SumOfDelayDuration': 'BIGINT',
+}
+
+
+class KPIEngine:
+    def __init__(self, dw):
+        self.conn_duckdb = dw.conn_duckdb
+
+    def kpis(self, granularity='year', by='manufacturer'):
+        """
+        Retorna FH, TO, ADOS, ADIS, DU, DC, DYR, CNR, TDR, ADD, RRh i RRc per grup i període
+        ADOS/ADIS/DU/DC i RRh/RRc depenen de fets mensuals: a nivell de dia o setmana són NULL
+        """
+        if granularity not in DATE_PERIODS:
+            raise ValueError(f"Unknown granularity '{granularity}' (expected one of {tuple(DATE_PERIODS)})")
+        if by not in GROUPS:
+            raise ValueError(f"Unknown grouping '{by}' (expected one of {tuple(GROUPS)})")
+        group = GROUPS[by]
+
+        monthly_ctes = ''
+        monthly_joins = ''
+        monthly_columns = '''
+                NULL AS ADOS,
+                NULL AS ADIS,
+                NULL AS DU,
+                NULL AS DC,'''
+        report_columns = '''
+                NULL AS RRh,
+                NULL AS RRc'''
+        if granularity in MONTH_PERIODS:
+            month_period = MONTH_PERIODS[granularity]
+            monthly_ctes = f''',
+            monthly AS (
+                SELECT
+                    {group} AS GroupName,
+                    {month_period} AS Period,
+                    COUNT(DISTINCT ms.AircraftKey) AS aircraft,
+                    SUM(ms.ADOSS + ms.ADOSU) AS outOfService,
+                    SUM(ms.PilotReportCount) AS pilotReports
+                FROM MonthlyAircraftSummary ms
+                JOIN Month m ON ms.MonthKey = m.MonthKey
+                JOIN Aircraft a ON ms.AircraftKey = a.AircraftKey
+                GROUP BY ALL
+            ),
+            maintenance AS (
+                SELECT
+                    {group} AS GroupName,
+                    {month_period} AS Period,
+                    SUM(mmr.MaintenanceReportCount) AS maintenanceReports
+                FROM MonthlyMaintenanceReports mmr
+                JOIN Month m ON mmr.MonthKey = m.MonthKey
+                JOIN Aircraft a ON mmr.AircraftKey = a.AircraftKey
+                GROUP BY ALL
+            ),
+            periods AS (
+                SELECT {month_period} AS Period, SUM(m.CoveredDays) AS PeriodDays
+                FROM Month m
+                GROUP BY ALL
+            )'''
+            monthly_joins = '''
+            JOIN periods p USING (Period)
+            LEFT JOIN monthly ms USING (GroupName, Period)
+            LEFT JOIN maintenance mr USING (GroupName, Period)'''
+            monthly_columns = '''
+                ROUND(ms.outOfService / ms.aircraft, 2) AS ADOS,
+                ROUND(p.PeriodDays - ms.outOfService / ms.aircraft, 2) AS ADIS,
+                ROUND((u.flightHours / u.aircraft) / ((p.PeriodDays - ms.outOfService / ms.aircraft) * 24), 2) AS DU,
+                ROUND((u.flightCycles / u.aircraft) / (p.PeriodDays - ms.outOfService / ms.aircraft), 2) AS DC,'''
+            report_columns = '''
+                1000 * ROUND(CAST(COALESCE(ms.pilotReports, 0) + COALESCE(mr.maintenanceReports, 0) AS REAL) / u.flightHours, 3) AS RRh,
+                100 * ROUND(CAST(COALESCE(ms.pilotReports, 0) + COALESCE(mr.maintenanceReports, 0) AS REAL) / u.flightCycles, 2) AS RRc'''
+
+        result = self.conn_duckdb.execute(f"""
+            WITH
+            utilization AS (
+                SELECT
+                    {group} AS GroupName,
+                    {DATE_PERIODS[granularity]} AS Period,
+                    COUNT(DISTINCT du.AircraftKey) AS aircraft,
+                    SUM(du.FlightHours) AS flightHours,
+                    SUM(du.FlightCycles) AS flightCycles,
+                    SUM(du.NumberOfDelays) AS delays,
+                    SUM(du.NumberOfCancellations) AS cancellations,
+                    SUM(du.SumOfDelayDuration) AS delayedMinutes
+                FROM DailyUtilization du
+                JOIN Date d ON du.DateKey = d.DateKey
+                JOIN Aircraft a ON du.AircraftKey = a.AircraftKey
+                GROUP BY ALL
+            ){monthly_ctes}
+            SELECT
+                u.GroupName,
+                u.Period,
+                ROUND(u.flightHours / u.aircraft, 2) AS FH,
+                ROUND(u.flightCycles / u.aircraft, 2) AS TakeOff,{monthly_columns}
+                100 * ROUND(u.delays / u.flightCycles, 4) AS DYR,
+                100 * ROUND(u.cancellations / u.flightCycles, 4) AS CNR,
+                100 - ROUND(100 * (u.delays + u.cancellations) / u.flightCycles, 2) AS TDR,
+                100 * ROUND(u.delayedMinutes / u.delays, 2) AS ADD,{report_columns}
+            FROM utilization u{monthly_joins}
+            ORDER BY u.GroupName, u.Period;
+            """).fetchall()
+        return result
+
+    def refresh_cumulative(self):
+        """
+        Precalcula les sumes acumulades diàries per aeronau sobre un calendari dens (tots els dies entre el
+        primer i l'últim fet), de manera que qualsevol finestra mòbil és una resta de dues files
+        """
+        cumulative_columns = ',\n'.join(
+            f"                    CAST(SUM(COALESCE(du.{measure}, 0)) OVER w AS {cumulative_type}) AS Cum{measure}"
+            for measure, cumulative_type in CUMULATIVE_MEASURES.items()
+        )
+        self.conn_duckdb.execute(f"""
+            CREATE OR REPLACE TABLE DailyCumulative AS
+            WITH
+                bounds AS (
+                    SELECT MIN(make_date(d.Year, d.Month, d.Day)) AS firstDate, MAX(make_date(d.Year, d.Month, d.Day)) AS lastDate
+                    FROM DailyUtilization du
+                    JOIN Date d ON du.DateKey = d.DateKey
+                ),
+                calendar AS (
+                    SELECT CAST(generate_series AS DATE) AS CalendarDate,
+                        CAST(strftime(generate_series, '%Y%m%d') AS INT) AS DateKey
+                    FROM bounds, generate_series(bounds.firstDate, bounds.lastDate, INTERVAL 1 DAY)
+                ),
+                spine AS (
+                    SELECT a.AircraftKey, c.CalendarDate, c.DateKey
+                    FROM Aircraft a CROSS JOIN calendar c
+                )
+            SELECT
+                s.AircraftKey,
+                s.CalendarDate,
+{cumulative_columns}
+            FROM spine s
+            LEFT JOIN DailyUtilization du ON du.AircraftKey = s.AircraftKey AND du.DateKey = s.DateKey
+            WINDOW w AS (PARTITION BY s.AircraftKey ORDER BY s.CalendarDate ROWS UNBOUNDED PRECEDING)
+            ORDER BY s.AircraftKey, s.CalendarDate;
+            """)
+
+    def rolling(self, window_days=30, aircraft_registration=None):
+        """
+        KPIs de la finestra mòbil dels últims window_days dies per aeronau i dia
+        Llegeix DailyCumulative, que DW.publish() construeix com un pas més de la càrrega
+        """
+        window_columns = ',\n'.join(
+            f"                    c.Cum{measure} - COALESCE(LAG(c.Cum{measure}, {int(window_days)}) OVER w, 0) AS {measure}"
+            for measure in CUMULATIVE_MEASURES
+        )
+        aircraft_filter = "WHERE a.AircraftRegistrationCode = ?" if aircraft_registration else ''
+        parameters = [aircraft_registration] if aircraft_registration else []
+        result = self.conn_duckdb.execute(f"""
+            WITH windowed AS (
+                SELECT
+                    c.AircraftKey,
+                    c.CalendarDate,
+{window_columns}
+                FROM DailyCumulative c
+                WINDOW w AS (PARTITION BY c.AircraftKey ORDER BY c.CalendarDate)
+            )
+            SELECT
+                a.AircraftRegistrationCode,
+                w.CalendarDate,
+                ROUND(w.FlightHours, 2) AS FH,
+                w.FlightCycles AS TakeOff,
+                100 * ROUND(w.NumberOfDelays / w.FlightCycles, 4) AS DYR,
+                100 * ROUND(w.NumberOfCancellations / w.FlightCycles, 4) AS CNR,
+                100 - ROUND(100 * (w.NumberOfDelays + w.NumberOfCancellations) / w.FlightCycles, 2) AS TDR,
+                100 * ROUND(w.SumOfDelayDuration / w.NumberOfDelays, 2) AS ADD
+            FROM windowed w
+            JOIN Aircraft a ON w.AircraftKey = a.AircraftKey
+            {aircraft_filter}
+            ORDER BY a.AircraftRegistrationCode, w.CalendarDate;
+            """, parameters).fetchall()
+        return result
@@ -1,4 +1,4 @@
-from tqdm import tqdm
+DEFAULT_BATCH_SIZE = 10000 # Files per transacció
 
 def load_dimension(transformed_data_source, dimension_object):
     """
@@ -7,65 +7,98 @@ def load_dimension(transformed_data_source, dimension_object):
     for row in transformed_data_source:
         dimension_object.ensure(row)
 
-def load_daily_utilization(dw, transformed_data_source):
+def denormalized_attributes(dw, aircraft_key, year):
+    """
+    Any i codi de fabricant per a les taules de fets amb layout ample (buit si el DW és normalitzat)
+    """
+    if not dw.wide_facts:
+        return {}
+    return dw.denormalized_attributes(aircraft_key, year)
+
+def load_in_batches(dw, fact_rows, fact_object, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Insereix files a una taula de fets fent commit cada batch_size files
+    Retorna el nombre de files carregades
+    """
+    loaded_rows = 0
+    dw.begin_batch()
+    for fact_row in fact_rows:
+        fact_object.insert(fact_row)
+        loaded_rows += 1
+        if loaded_rows % batch_size == 0:
+            dw.commit_batch()
+            dw.begin_batch()
+    dw.commit_batch()
+    return loaded_rows
+
+def load_daily_utilization(dw, transformed_data_source, batch_size=DEFAULT_BATCH_SIZE):
     """
     Carrega les dades transformades a la taula de fets DailyUtilization
     """
-    for row in transformed_data_source:
-        # Buscar DateKey
-        date_key_int = int(f"{row['date'].year}{str(row['date'].month).zfill(2)}{str(row['date'].day).zfill(2)}") # YYYYMMDD
-        date_key = dw.date_dim.lookup({'DateKey': date_key_int})
-        
-        # Buscar AircraftKey
-        aircraft_key = dw.aircraft_dim.lookup({'AircraftRegistrationCode': row['aircraftregistration']})
+    def fact_rows():
+        for row in transformed_data_source:
+            # Buscar DateKey
+            date_key_int = int(f"{row['date'].year}{str(row['date'].month).zfill(2)}{str(row['date'].day).zfill(2)}") # YYYYMMDD
+            date_key = dw.date_dim.lookup({'DateKey': date_key_int})
+
+            # Buscar AircraftKey
+            aircraft_key = dw.aircraft_dim.lookup({'AircraftRegistrationCode': row['aircraftregistration']})
 
-        fact_row = {
-            'DateKey': date_key,
-            'AircraftKey': aircraft_key,
-            'FlightHours': row['FlightHours'],
-            'FlightCycles': row['FlightCycles'],
-            'NumberOfDelays': row['NumberOfDelays'],
-            'NumberOfCancellations': row['NumberOfCancellations'],
-            'SumOfDelayDuration': row['SumOfDelayDuration']
-        }
-        dw.daily_utilization_fact.insert(fact_row)
+            yield {
+                'DateKey': date_key,
+                'AircraftKey': aircraft_key,
+                'FlightHours': row['FlightHours'],
+                'FlightCycles': row['FlightCycles'],
+                'NumberOfDelays': row['NumberOfDelays'],
+                'NumberOfCancellations': row['NumberOfCancellations'],
+                'SumOfDelayDuration': row['SumOfDelayDuration'],
+                **denormalized_attributes(dw, aircraft_key, row['date'].year)
+            }
 
-def load_monthly_summary(dw, transformed_data_source):
+    return load_in_batches(dw, fact_rows(), dw.daily_utilization_fact, batch_size)
+
+def load_monthly_summary(dw, transformed_data_source, batch_size=DEFAULT_BATCH_SIZE):
     """
     Carrega les dades transformades a la taula de fets MonthlyAircraftSummary
     """
-    for row in transformed_data_source:
-        # Buscar MonthKey
-        month_key = dw.month_dim.lookup({'MonthKey': int(row['MonthKey'])})
-        
-        # Buscar AircraftKey
-        aircraft_key = dw.aircraft_dim.lookup({'AircraftRegistrationCode': row['aircraftregistration']})
+    def fact_rows():
+        for row in transformed_data_source:
+            # Buscar MonthKey
+            month_key = dw.month_dim.lookup({'MonthKey': int(row['MonthKey'])})
+
+            # Buscar AircraftKey
+            aircraft_key = dw.aircraft_dim.lookup({'AircraftRegistrationCode': row['aircraftregistration']})
+
+            yield {
+                'MonthKey': month_key,
+                'AircraftKey': aircraft_key,
+                'ADIS': row['ADIS'],
+                'ADOSS': row['ADOSS'],
+                'ADOSU': row['ADOSU'],
+                'PilotReportCount': row['PilotReportCount'],
+                **denormalized_attributes(dw, aircraft_key, int(row['MonthKey']) // 100)
+            }
 
-        fact_row = {
-            'MonthKey': month_key,
-            'AircraftKey': aircraft_key,
-            'ADIS': row['ADIS'],
-            'ADOSS': row['ADOSS'],
-            'ADOSU': row['ADOSU'],
-            'PilotReportCount': row['PilotReportCount']
-        }
-        dw.monthly_summary_fact.insert(fact_row)
+    return load_in_batches(dw, fact_rows(), dw.monthly_summary_fact, batch_size)
 
-def load_monthly_maintenance_reports(dw, transformed_data_source):
+def load_monthly_maintenance_reports(dw, transformed_data_source, batch_size=DEFAULT_BATCH_SIZE):
     """
     Carrega les dades transformades a la taula MonthlyMaintenanceReports
     """
-    for row in transformed_data_source:
-        # Buscar MonthKey
-        month_key = dw.month_dim.lookup({'MonthKey': int(row['MonthKey'])})
-        
-        # Buscar AircraftKey
-        aircraft_key = dw.aircraft_dim.lookup({'AircraftRegistrationCode': row['aircraftregistration']})
-        
-        fact_row = {
-            'MonthKey': month_key,
-            'AircraftKey': aircraft_key,
-            'AirportCode': row['AirportCode'],
-            'MaintenanceReportCount': row['MaintenanceReportCount']
-        }
-        dw.monthly_maintenance_reports_fact.insert(fact_row)
\ No newline at end of file
+    def fact_rows():
+        for row in transformed_data_source:
+            # Buscar MonthKey
+            month_key = dw.month_dim.lookup({'MonthKey': int(row['MonthKey'])})
+
+            # Buscar AircraftKey
+            aircraft_key = dw.aircraft_dim.lookup({'AircraftRegistrationCode': row['aircraftregistration']})
+
+            yield {
+                'MonthKey': month_key,
+                'AircraftKey': aircraft_key,
+                'AirportCode': row['AirportCode'],
+                'MaintenanceReportCount': row['MaintenanceReportCount'],
+                **denormalized_attributes(dw, aircraft_key, int(row['MonthKey']) // 100)
+            }
+
+    return load_in_batches(dw, fact_rows(), dw.monthly_maintenance_reports_fact, batch_size)
@@ -0,0 +1,186 @@
+"""
+Captura dels plans d'execució (EXPLAIN ANALYZE) de les consultes de KPIs del DW i de les consultes baseline
+
+Cada pla es redueix a una llista d'operadors en preordre (profunditat, operador, files, temps propi en ms), igual per
+DuckDB i per PostgreSQL, i es desa en JSON. Cada consulta s'executa diverses vegades i els temps són medianes: una sola
+execució pot duplicar el temps per soroll. diff_reports() compara un informe amb un baseline desat: només els canvis de
+forma del pla i les regressions del temps total per sobre del soroll són regressions; els canvis de cardinalitat (p. ex.
+després de carregar més dades) i de temps d'un operador es reporten com a informació.
+"""
+import json
+import statistics
+from pathlib import Path
+import extract
+
+QUERIES = ('utilization', 'reporting', 'reporting_per_role')
+
+default_baseline_filename = 'query_plans_baseline.json'
+
+# Una regressió de temps ha de superar les dues condicions, sobre medianes (evita soroll en consultes de mil·lisegons)
+TIME_REGRESSION_RATIO = 1.5
+TIME_REGRESSION_MIN_MS = 5.0
+
+PLAN_REPETITIONS = 5
+
+
+def _duckdb_operators(node, depth, operators):
+    operators.append({
+        'depth': depth,
+        'operator': node['operator_name'].strip(),
+        'rows': node.get('operator_cardinality', 0),
+        'time_ms': round(node.get('operator_timing', 0) * 1000, 3),
+    })
+    for child in node.get('children', []):
+        _duckdb_operators(child, depth + 1, operators)
+
+
+def explain_duckdb(conn_duckdb, sql):
+    """
+    EXPLAIN ANALYZE amb sortida JSON de DuckDB (temps per operador en segons, ja exclusius)
+    """
+    row = conn_duckdb.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}").fetchone()
+    profile = json.loads(row[1])
+    operators = []
+    for child in profile['children']:
+        # L'arrel és el mateix EXPLAIN_ANALYZE: es comença pels seus fills
+        nodes = child['children'] if child['operator_type'] == 'EXPLAIN_ANALYZE' else [child]
+        for node in nodes:
+            _duckdb_operators(node, 0, operators)
+    return {'engine': 'duckdb', 'total_ms': round(profile['latency'] * 1000, 3), 'operators': operators}
+
+
+def _postgres_operators(node, depth, operators):
+    # Temps i files de PostgreSQL són per iteració (loops) i el temps inclou els fills
+    loops = node.get('Actual Loops', 1)
+    total_ms = node.get('Actual Total Time', 0) * loops
+    children = node.get('Plans', [])
+    children_ms = sum(child.get('Actual Total Time', 0) * child.get('Actual Loops', 1) for child in children)
+    operators.append({
+        'depth': depth,
+        'operator': node['Node Type'],
+        'rows': node.get('Actual Rows', 0) * loops,
+        'time_ms': round(max(total_ms - children_ms, 0), 3),
+    })
+    for child in children:
+        _postgres_operators(child, depth + 1, operators)
+
+
+def explain_postgres(conn_postgres, sql):
+    """
+    EXPLAIN (ANALYZE, FORMAT JSON) de PostgreSQL
+    """
+    cur = conn_postgres.cursor()
+    cur.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}")
+    plan = cur.fetchone()[0]
+    cur.close()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    operators = []
+    _postgres_operators(plan[0]['Plan'], 0, operators)
+    return {'engine': 'postgres', 'total_ms': round(plan[0]['Execution Time'], 3), 'operators': operators}
+
+
+def explain_baseline(sql):
+    """
+    Pla de la consulta baseline a la font configurada a extract (PostgreSQL o el substitut DuckDB)
+    """
+    if extract.source_backend == 'postgres':
+        return explain_postgres(extract.get_connection(), sql)
+    return explain_duckdb(extract.get_connection(), sql)
+
+
+def median_plan(explain, repetitions=PLAN_REPETITIONS):
+    """
+    Executa explain() repetitions vegades: pla i files de la primera execució, temps medians de les que tenen la
+    mateixa forma (un canvi de pla entre execucions no barreja temps d'operadors diferents)
+    """
+    plans = [explain() for _ in range(repetitions)]
+    plan = plans[0]
+    same_shape = [other for other in plans if _shape(other) == _shape(plan)]
+    plan['total_ms'] = round(statistics.median(other['total_ms'] for other in plans), 3)
+    for position, operator in enumerate(plan['operators']):
+        operator['time_ms'] = round(statistics.median(other['operators'][position]['time_ms'] for other in same_shape), 3)
+    plan['repetitions'] = repetitions
+    return plan
+
+
+def capture_plans(dw, repetitions=PLAN_REPETITIONS):
+    """
+    Informe amb el pla del DW i el del baseline per a cada consulta de KPIs (temps medians de repetitions execucions)
+    """
+    report = {}
+    for name in QUERIES:
+        dw_sql = getattr(dw, f"{name}_sql")()
+        baseline_sql = getattr(extract, f"query_{name}_baseline_sql")()
+        report[name] = {
+            'dw': median_plan(lambda: explain_duckdb(dw.conn_duckdb, dw_sql), repetitions),
+            'baseline': median_plan(lambda: explain_baseline(baseline_sql), repetitions),
+        }
+    return report
+
+
+def save_report(report, filename=default_baseline_filename):
+    Path(filename).write_text(json.dumps(report, indent=2))
+
+
+def load_report(filename=default_baseline_filename):
+    return json.loads(Path(filename).read_text())
+
+
+def _shape(plan):
+    return [(operator['depth'], operator['operator']) for operator in plan['operators']]
+
+
+def _slower(old_ms, new_ms, ratio, min_ms):
+    return new_ms > old_ms * ratio and new_ms - old_ms > min_ms
+
+
+def diff_plans(baseline, current, ratio=TIME_REGRESSION_RATIO, min_ms=TIME_REGRESSION_MIN_MS):
+    """
+    Diferències d'un pla respecte al del baseline: (regressions, informació)
+    Regressions: canvi de forma del pla o temps total medià per sobre del llindar
+    Informació: canvis de files i de temps d'un operador. Si la forma canvia, no es comparen els operadors un a un
+    """
+    differences, notes = [], []
+    if _shape(baseline) != _shape(current):
+        baseline_shape, current_shape = _shape(baseline), _shape(current)
+        position = next((i for i, (old, new) in enumerate(zip(baseline_shape, current_shape)) if old != new),
+                        min(len(baseline_shape), len(current_shape)))
+        old = baseline_shape[position][1] if position < len(baseline_shape) else '-'
+        new = current_shape[position][1] if position < len(current_shape) else '-'
+        differences.append(f"pla canviat a l'operador {position}: {old} -> {new} "
+                           f"({len(baseline_shape)} -> {len(current_shape)} operadors)")
+    else:
+        for position, (old, new) in enumerate(zip(baseline['operators'], current['operators'])):
+            if old['rows'] != new['rows']:
+                notes.append(f"{position} {new['operator']}: files {old['rows']} -> {new['rows']}")
+            if _slower(old['time_ms'], new['time_ms'], ratio, min_ms):
+                notes.append(f"{position} {new['operator']}: temps {old['time_ms']} -> {new['time_ms']} ms")
+    if _slower(baseline['total_ms'], current['total_ms'], ratio, min_ms):
+        differences.append(f"temps total {baseline['total_ms']} -> {current['total_ms']} ms")
+    return differences, notes
+
+
+def diff_reports(baseline, current, ratio=TIME_REGRESSION_RATIO, min_ms=TIME_REGRESSION_MIN_MS):
+    """
+    Retorna ({consulta/costat: [regressions]}, {consulta/costat: [informació]}) només per als plans amb diferències
+    """
+    regressions, notes = {}, {}
+    for name, sides in current.items():
+        for side, plan in sides.items():
+            if name not in baseline or side not in baseline[name]:
+                continue
+            differences, plan_notes = diff_plans(baseline[name][side], plan, ratio, min_ms)
+            if differences:
+                regressions[f"{name}/{side}"] = differences
+            if plan_notes:
+                notes[f"{name}/{side}"] = plan_notes
+    return regressions, notes
+
+
+def print_report(report):
+    for name, sides in report.items():
+        for side, plan in sides.items():
+            print(f"\n--- {name} ({side}, {plan['engine']}): {plan['total_ms']} ms (mediana de {plan.get('repetitions', 1)}) ---")
+            for operator in plan['operators']:
+                print(f"{'  ' * operator['depth']}{operator['operator']}: {operator['rows']} files, {operator['time_ms']} ms")
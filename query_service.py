@@ -0,0 +1,111 @@
+"""
+Servei asíncron de consultes de KPIs sobre el DW amb un pool de connexions de només lectura
+
+Cada generació del pool adjunta (ATTACH ... READ_ONLY) el fitxer del DW des d'una instància DuckDB en memòria pròpia.
+Quan l'ETL publica un DW nou (os.replace sobre el mateix nom), el servei ho detecta per l'inode del fitxer i obre una
+generació nova; les consultes en curs acaben sobre la versió anterior, que es tanca quan queda lliure.
+"""
+import argparse
+import asyncio
+import os
+import time
+import duckdb # https://duckdb.org
+from dw import DWQueries, duckdb_filename
+
+QUERIES = ('query_utilization', 'query_reporting', 'query_reporting_per_role')
+
+
+class _PoolGeneration:
+    def __init__(self, filename, pool_size):
+        self.file_id = _file_id(filename)
+        self.conn_duckdb = duckdb.connect(':memory:')
+        escaped_filename = filename.replace("'", "''")
+        self.conn_duckdb.execute(f"ATTACH '{escaped_filename}' AS dw (READ_ONLY)")
+        self.readers = asyncio.Queue()
+        for _ in range(pool_size):
+            cursor = self.conn_duckdb.cursor() # Cada cursor és una connexió independent a la mateixa instància
+            cursor.execute("USE dw")
+            self.readers.put_nowait(DWQueries(cursor))
+        self.in_use = 0
+        self.retired = False
+
+    def close_if_idle(self):
+        if self.retired and self.in_use == 0:
+            self.conn_duckdb.close()
+
+
+def _file_id(filename):
+    stat = os.stat(filename)
+    return stat.st_dev, stat.st_ino
+
+
+class QueryService:
+    def __init__(self, filename=duckdb_filename, pool_size=4):
+        self.filename = filename
+        self.pool_size = pool_size
+        self._generation = None
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        self._generation = await asyncio.to_thread(_PoolGeneration, self.filename, self.pool_size)
+        return self
+
+    async def _current_generation(self):
+        """
+        Retorna la generació actual, obrint-ne una de nova si s'ha publicat un DW nou
+        """
+        async with self._lock:
+            if _file_id(self.filename) != self._generation.file_id:
+                previous = self._generation
+                self._generation = await asyncio.to_thread(_PoolGeneration, self.filename, self.pool_size)
+                previous.retired = True
+                previous.close_if_idle()
+                print(f"[query_service.py] Nova versió del DW '{self.filename}' carregada")
+            return self._generation
+
+    async def query(self, name):
+        if name not in QUERIES:
+            raise ValueError(f"Unknown query '{name}' (expected one of {QUERIES})")
+        generation = await self._current_generation()
+        generation.in_use += 1
+        reader = await generation.readers.get()
+        try:
+            return await asyncio.to_thread(getattr(reader, name))
+        finally:
+            generation.readers.put_nowait(reader)
+            generation.in_use -= 1
+            generation.close_if_idle()
+
+    async def query_all(self):
+        """
+        Executa les tres consultes de KPIs concurrentment
+        """
+        results = await asyncio.gather(*(self.query(name) for name in QUERIES))
+        return dict(zip(QUERIES, results))
+
+    async def close(self):
+        async with self._lock:
+            self._generation.retired = True
+            self._generation.close_if_idle()
+
+
+async def main(filename, pool_size, repetitions):
+    service = await QueryService(filename, pool_size).start()
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        results = await service.query_all()
+        end = time.perf_counter()
+        for name, result in results.items():
+            print(f"{name}: {result}")
+        print(f"Execution time (concurrent): {end - start:.4f} seconds")
+    await service.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Consultes de KPIs concurrents sobre el DW (només lectura)")
+    parser.add_argument('--filename', default=duckdb_filename)
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--repetitions', type=int, default=1)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.filename, args.pool_size, args.repetitions))
@@ -1,6 +1,9 @@
+import argparse
+import sys
 import time
-from dw import DW
+from dw import open_queries, APPROXIMATE_GRANULARITIES, DEFAULT_SAMPLE_PERCENT
 import extract
+import query_plans
 
 
 def time_and_print(function):
@@ -11,8 +14,72 @@ def time_and_print(function):
     print(f"Execution time: {end - start:.4f} seconds")
 
 
+def print_differences(title, differences):
+    print(f"\n*************************************************** {title}")
+    for plan, plan_differences in differences.items():
+        print(f"{plan}:")
+        for difference in plan_differences:
+            print(f"  {difference}")
+
+
+def check_plans(dw, baseline_filename, save_baseline, repetitions=query_plans.PLAN_REPETITIONS):
+    """
+    Captura els plans (EXPLAIN ANALYZE, temps medians) del DW i del baseline i els compara amb el baseline desat
+    Retorna 1 si hi ha regressions (per aturar una CI): canvis de forma o temps total per sobre del soroll, 0 altrament
+    Els canvis de cardinalitat i de temps d'un operador només s'informen
+    """
+    report = query_plans.capture_plans(dw, repetitions)
+    query_plans.print_report(report)
+    if save_baseline:
+        query_plans.save_report(report, baseline_filename)
+        print(f"\nBaseline de plans desat a '{baseline_filename}'")
+        return 0
+    try:
+        baseline = query_plans.load_report(baseline_filename)
+    except FileNotFoundError:
+        print(f"\nNo hi ha baseline de plans a '{baseline_filename}' (useu --save-baseline)")
+        return 0
+    regressions, notes = query_plans.diff_reports(baseline, report)
+    if notes:
+        print_differences("Canvis de plans (informació)", notes)
+    if not regressions:
+        print("\nCap regressió de plans respecte al baseline")
+        return 0
+    print_differences("Regressions de plans", regressions)
+    return 1
+
+
 if __name__ == '__main__':
-    dw = DW(create=False)
+    parser = argparse.ArgumentParser(description="Consultes de KPIs del DW contra les consultes baseline")
+    parser.add_argument('--plans', action='store_true', help="Captura EXPLAIN ANALYZE i compara amb el baseline de plans")
+    parser.add_argument('--save-baseline', action='store_true', help="Desa els plans capturats com a nou baseline")
+    parser.add_argument('--baseline', default=query_plans.default_baseline_filename, help="Fitxer JSON del baseline de plans")
+    parser.add_argument('--plan-repetitions', type=int, default=query_plans.PLAN_REPETITIONS, help="Execucions de cada pla (temps medians)")
+    parser.add_argument('--approximate', action='store_true', help="Compara el mode exacte amb el mode aproximat (mostreig)")
+    parser.add_argument('--granularity', choices=tuple(APPROXIMATE_GRANULARITIES), default='year', help="Període del mode aproximat")
+    parser.add_argument('--sample-percent', type=float, default=DEFAULT_SAMPLE_PERCENT, help="Percentatge de blocs de DailyUtilization mostrejats")
+    parser.add_argument('--source', choices=extract.SOURCE_BACKENDS, default=extract.source_backend, help="Font de dades AIMS/AMOS")
+    args = parser.parse_args()
+
+    extract.configure_source(args.source)
+    dw = open_queries() # Només lectura: no carrega pygrametl
+    if args.plans or args.save_baseline:
+        status = check_plans(dw, args.baseline, args.save_baseline, args.plan_repetitions)
+        dw.close()
+        sys.exit(status)
+    if args.approximate:
+        print("\n*************************************************** Query Aircraft Utilization")
+        print("============================== Exact =====================================")
+        time_and_print(dw.query_utilization)
+        print("=========================== Approximate ==================================")
+        time_and_print(lambda: dw.approximate_utilization(args.granularity, args.sample_percent))
+        print("\n************************************************************* Query Reporting")
+        print("============================== Exact =====================================")
+        time_and_print(dw.query_reporting)
+        print("=========================== Approximate ==================================")
+        time_and_print(lambda: dw.approximate_reporting(args.granularity, args.sample_percent))
+        dw.close()
+        sys.exit(0)
     print("\n*************************************************** Query Aircraft Utilization")
     print("================================ DW ======================================")
     time_and_print(dw.query_utilization)
@@ -0,0 +1,120 @@
+"""
+Registre estructurat dels registres rebutjats per les regles de neteja (BR-*)
+
+Els rebuigs s'acumulen en memòria i s'escriuen per lots, sense formatar cap missatge: JSON Lines (una línia compacta
+per registre) o Parquet (zstd, via DuckDB). Cada rebuig porta el codi de la regla (reason) i la font (source);
+step_summary() dona el recompte per (source, reason) des del pas anterior, que l'ETL desa a la taula RejectionSummary
+del DW en marcar cada pas com a completat.
+"""
+import json
+import os
+from collections import Counter
+from itertools import islice
+
+REJECTION_FORMATS = ('jsonl', 'parquet')
+
+# Codis de rebuig
+INVALID_AIRCRAFT = 'BR-ValidAircraftRegistration'
+OVERLAPPING_FLIGHT = 'BR-21'
+
+default_rejections_filename = 'cleaning.jsonl'
+DEFAULT_REJECTION_BATCH_SIZE = 10000
+
+
+class RejectionSink:
+    def __init__(self, filename=default_rejections_filename, file_format='jsonl', batch_size=DEFAULT_REJECTION_BATCH_SIZE,
+                 resume_rows=None):
+        """
+        El fitxer es buida en crear el sink (un fitxer per execució de l'ETL)
+        resume_rows: en reprendre l'ETL, rebuigs dels passos ja completats (RejectionSummary). Es conserven les primeres
+        resume_rows files del fitxer i s'hi afegeixen les noves; la resta eren d'un pas que no va acabar
+        """
+        if file_format not in REJECTION_FORMATS:
+            raise ValueError(f"Unknown rejection format '{file_format}' (expected one of {REJECTION_FORMATS})")
+        self.filename = filename
+        self.file_format = file_format
+        self.batch_size = batch_size
+        self.recording = True # False mentre es tornen a transformar dades d'un pas ja completat
+        self.counts = Counter() # (source, reason) -> files rebutjades
+        self._step_counts = Counter() # Igual, des de l'últim step_summary()
+        self._buffer = []
+        resume = resume_rows is not None and os.path.exists(filename)
+        if file_format == 'jsonl':
+            kept_lines = []
+            if resume:
+                with open(filename, encoding='utf-8') as rejections_file:
+                    kept_lines = list(islice(rejections_file, resume_rows))
+            self._file = open(filename, 'w', encoding='utf-8')
+            self._file.writelines(kept_lines)
+        else:
+            import duckdb # Parquet s'escriu amb DuckDB (sense dependència de pyarrow)
+            self._conn = duckdb.connect(':memory:')
+            self._conn.execute("CREATE TABLE rejections (source VARCHAR, reason VARCHAR, record VARCHAR)")
+            if resume:
+                self._conn.execute(f"""
+                    INSERT INTO rejections
+                    SELECT source, reason, record FROM read_parquet(?, file_row_number = true)
+                    WHERE file_row_number < {int(resume_rows)}
+                    ORDER BY file_row_number
+                    """, [filename])
+
+    def reject(self, reason, source, record):
+        """
+        Afegeix un registre rebutjat (dict); només es serialitza en buidar el lot
+        """
+        if not self.recording:
+            return
+        self._buffer.append((source, reason, record))
+        self.counts[(source, reason)] += 1
+        self._step_counts[(source, reason)] += 1
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        rows = [(source, reason, json.dumps(record, default=str, separators=(',', ':')))
+                for source, reason, record in self._buffer]
+        if self.file_format == 'jsonl':
+            self._file.writelines(
+                f'{{"source":{json.dumps(source)},"reason":{json.dumps(reason)},"record":{record}}}\n'
+                for source, reason, record in rows
+            )
+        else:
+            self._conn.executemany("INSERT INTO rejections VALUES (?, ?, ?)", rows)
+        self._buffer = []
+
+    def _persist(self):
+        """
+        Buida el lot i deixa el fitxer al dia (Parquet es reescriu sencer)
+        """
+        self.flush()
+        if self.file_format == 'jsonl':
+            self._file.flush()
+        else:
+            escaped_filename = self.filename.replace("'", "''")
+            self._conn.execute(f"COPY rejections TO '{escaped_filename}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+
+    def summary(self):
+        """
+        Llista de (source, reason, files rebutjades) d'aquesta execució
+        """
+        return [(source, reason, count) for (source, reason), count in sorted(self.counts.items())]
+
+    def step_summary(self):
+        """
+        Com summary(), però només dels rebuigs des de la crida anterior. Abans es desen al fitxer, perquè en reprendre
+        l'ETL el fitxer contingui com a mínim els rebuigs dels passos completats
+        """
+        if self._step_counts:
+            self._persist()
+        step_counts = [(source, reason, count) for (source, reason), count in sorted(self._step_counts.items())]
+        self._step_counts = Counter()
+        return step_counts
+
+    def close(self):
+        self._persist()
+        if self.file_format == 'jsonl':
+            self._file.close()
+        else:
+            self._conn.close()
@@ -0,0 +1,285 @@
+"""
+Generador de dades sintètiques escalables per fer benchmarks sense les fonts AIMS/AMOS
+Les files tenen el mateix format que les sortides de transform.py, així es poden carregar amb load.py
+"""
+import datetime
+from collections import Counter
+import os
+import duckdb
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import load
+from dw import FACT_SORT_KEYS
+
+MANUFACTURERS = {'Airbus': ('A320', 'A350 XWB'), 'Boeing': ('737', '787')}
+AIRPORTS = ('BCN', 'CGN', 'TZL', 'MAD', 'LHR', 'FRA')
+
+
+def generate_aircraft(n_aircraft, seed=0):
+    rng = np.random.default_rng(seed)
+    manufacturers = list(MANUFACTURERS)
+    aircraft = []
+    for i in range(n_aircraft):
+        manufacturer = manufacturers[rng.integers(len(manufacturers))]
+        models = MANUFACTURERS[manufacturer]
+        aircraft.append({
+            'AircraftRegistrationCode': f"XY-{i:04d}",
+            'AircraftModel': models[rng.integers(len(models))],
+            'AircraftManufacturer': manufacturer
+        })
+    return aircraft
+
+
+def generate_dates(n_days, start=datetime.date(2020, 1, 1)):
+    """
+    Retorna (date_data, month_data) amb el format de transform.transform_date_dimensions
+    """
+    dates = pd.date_range(start, periods=n_days, freq='D')
+    covered_days = Counter((d.year, d.month) for d in dates)
+    date_data = [{
+        'DateKey': d.year * 10000 + d.month * 100 + d.day,
+        'FullDate': f"{d.year}-{d.month}-{d.day}",
+        'Day': d.day,
+        'Month': d.month,
+        'Year': d.year,
+        'ISOYear': d.isocalendar()[0],
+        'ISOWeek': d.isocalendar()[1]
+    } for d in dates]
+
+    month_data = [{
+        'MonthKey': d.year * 100 + d.month,
+        'Month': d.month,
+        'Year': d.year,
+        'DaysInMonth': d.days_in_month,
+        'CoveredDays': covered_days[(d.year, d.month)]
+    } for d in dates if d.day == 1 or d == dates[0]]
+    return date_data, month_data
+
+
+def generate_daily_utilization(aircraft, n_days, start=datetime.date(2020, 1, 1), seed=0):
+    """
+    Una fila per dia i aeronau (format de transform.transform_daily_utilization)
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start, periods=n_days, freq='D').date
+    registrations = [a['AircraftRegistrationCode'] for a in aircraft]
+    n = len(dates) * len(registrations)
+
+    flight_cycles = rng.integers(0, 6, n)
+    cancellations = rng.binomial(1, 0.03, n)
+    delays = rng.binomial(flight_cycles, 0.15)
+    df = pd.DataFrame({
+        'date': np.repeat(dates, len(registrations)),
+        'aircraftregistration': np.tile(registrations, len(dates)),
+        'FlightHours': np.round(flight_cycles * rng.uniform(1.0, 3.5, n), 2),
+        'FlightCycles': flight_cycles,
+        'NumberOfDelays': delays,
+        'NumberOfCancellations': cancellations,
+        'SumOfDelayDuration': delays * rng.integers(16, 90, n)
+    })
+    return df.to_dict('records')
+
+
+def generate_monthly_summary(aircraft, month_data, seed=0):
+    """
+    Una fila per mes i aeronau (format de transform.transform_monthly_summary)
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for month in month_data:
+        for a in aircraft:
+            adoss = round(float(rng.uniform(0, 3)), 2)
+            adosu = round(float(rng.exponential(0.5)), 2)
+            rows.append({
+                'MonthKey': month['MonthKey'],
+                'aircraftregistration': a['AircraftRegistrationCode'],
+                'ADOSS': adoss,
+                'ADOSU': adosu,
+                'ADIS': round(month['CoveredDays'] - adoss - adosu, 2),
+                'PilotReportCount': int(rng.poisson(4))
+            })
+    return rows
+
+
+def generate_monthly_maintenance_reports(aircraft, month_data, seed=0):
+    """
+    Una fila per mes, aeronau i aeroport amb informes (format de transform.transform_monthly_maintenance_reports)
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for month in month_data:
+        for a in aircraft:
+            for airport in rng.choice(AIRPORTS, size=rng.integers(1, 3), replace=False):
+                rows.append({
+                    'MonthKey': month['MonthKey'],
+                    'aircraftregistration': a['AircraftRegistrationCode'],
+                    'AirportCode': str(airport),
+                    'MaintenanceReportCount': int(rng.poisson(3)) + 1
+                })
+    return rows
+
+
+def load_synthetic_dw(dw, n_aircraft=100, n_days=730, seed=0, batch_size=None):
+    """
+    Carrega un DW sintètic complet amb load.py i retorna el nombre de files de fets
+    """
+    batch_size = batch_size or load.DEFAULT_BATCH_SIZE
+    aircraft = generate_aircraft(n_aircraft, seed)
+    date_data, month_data = generate_dates(n_days)
+
+    dw.begin_batch()
+    load.load_dimension(aircraft, dw.aircraft_dim)
+    load.load_dimension(date_data, dw.date_dim)
+    load.load_dimension(month_data, dw.month_dim)
+    dw.commit_batch()
+
+    loaded_rows = load.load_daily_utilization(dw, iter(generate_daily_utilization(aircraft, n_days, seed=seed)), batch_size)
+    loaded_rows += load.load_monthly_summary(dw, iter(generate_monthly_summary(aircraft, month_data, seed)), batch_size)
+    loaded_rows += load.load_monthly_maintenance_reports(dw, iter(generate_monthly_maintenance_reports(aircraft, month_data, seed)), batch_size)
+    return loaded_rows
+
+
+def bulk_load_synthetic_dw(dw, n_aircraft=100, n_days=730, seed=0):
+    """
+    Com load_synthetic_dw però amb els fets inserits per SQL des de DataFrames, per arribar a volums escalats (milions de
+    files) en segons. Les dimensions es carreguen amb load.py i AircraftKey s'obté amb un join per matrícula
+    Retorna el nombre de files de fets
+    """
+    aircraft = generate_aircraft(n_aircraft, seed)
+    date_data, month_data = generate_dates(n_days)
+
+    dw.begin_batch()
+    load.load_dimension(aircraft, dw.aircraft_dim)
+    load.load_dimension(date_data, dw.date_dim)
+    load.load_dimension(month_data, dw.month_dim)
+    dw.commit_batch()
+
+    daily = pd.DataFrame(generate_daily_utilization(aircraft, n_days, seed=seed))
+    daily.insert(0, 'DateKey', [d.year * 10000 + d.month * 100 + d.day for d in daily.pop('date')])
+    facts = {
+        'DailyUtilization': (daily, 'DateKey // 10000'),
+        'MonthlyAircraftSummary': (pd.DataFrame(generate_monthly_summary(aircraft, month_data, seed)), 'MonthKey // 100'),
+        'MonthlyMaintenanceReports': (pd.DataFrame(generate_monthly_maintenance_reports(aircraft, month_data, seed)), 'MonthKey // 100'),
+    }
+    if dw.wide_facts:
+        dw.denormalized_attributes(dw.aircraft_dim.lookup(aircraft[0]), date_data[0]['Year']) # Omple Manufacturer
+
+    loaded_rows = 0
+    for table, (frame, year_expression) in facts.items():
+        wide_columns, wide_join = '', ''
+        if dw.wide_facts:
+            wide_columns = f", f.{year_expression} AS Year, m.ManufacturerCode"
+            wide_join = "JOIN Manufacturer m ON a.AircraftManufacturer = m.AircraftManufacturer"
+        dw.conn_duckdb.register('synthetic_facts', frame)
+        dw.conn_duckdb.execute(f"""
+            INSERT INTO {table} BY NAME
+            SELECT f.* EXCLUDE (aircraftregistration), a.AircraftKey{wide_columns}
+            FROM synthetic_facts f
+            JOIN Aircraft a ON f.aircraftregistration = a.AircraftRegistrationCode
+            {wide_join}
+            ORDER BY {', '.join(FACT_SORT_KEYS[table])}
+            """)
+        dw.conn_duckdb.unregister('synthetic_facts')
+        loaded_rows += len(frame)
+    return loaded_rows
+
+
+# ====================================================================================================================================
+# Fonts sintètiques (AIMS/AMOS en DuckDB + CSVs de lookup) per executar l'ETL i les consultes baseline sense PostgreSQL
+def generate_source_database(filename='sources.duckdb', data_directory='data_synthetic', n_aircraft=50, n_days=365,
+                             flights_per_day=3, start=datetime.date(2020, 1, 1), dirty_ratio=0.01, seed=0):
+    """
+    Crea una base de dades DuckDB amb els esquemes AIMS i AMOS i els CSVs de lookup a data_directory
+    Una fracció dirty_ratio de files incompleix les regles de negoci (BR-21, BR-23, aeronau invàlida, data fora de rang)
+    Retorna el nombre de files generades per taula
+    """
+    rng = np.random.default_rng(seed)
+    data_directory = Path(data_directory)
+    data_directory.mkdir(parents=True, exist_ok=True)
+
+    aircraft = generate_aircraft(n_aircraft, seed)
+    registrations = np.array([a['AircraftRegistrationCode'] for a in aircraft])
+    pd.DataFrame({
+        'aircraft_reg_code': registrations,
+        'manufacturer_serial_number': [f"MSN {1000 + i}" for i in range(n_aircraft)],
+        'aircraft_model': [a['AircraftModel'] for a in aircraft],
+        'aircraft_manufacturer': [a['AircraftManufacturer'] for a in aircraft]
+    }).to_csv(data_directory / 'aircraft-manufacturerinfo-lookup.csv', index=False)
+
+    personnel = pd.DataFrame({
+        'reporteurid': np.arange(1000, 1000 + max(10, n_aircraft)),
+        'airport': rng.choice(AIRPORTS, max(10, n_aircraft))
+    })
+    personnel.to_csv(data_directory / 'maintenance_personnel.csv', index=False)
+
+    # AIMS.flights: flights_per_day vols seguits per aeronau i dia
+    n_flights = n_aircraft * n_days * flights_per_day
+    day_offsets = np.repeat(np.arange(n_days), n_aircraft * flights_per_day)
+    slot = np.tile(np.arange(flights_per_day), n_aircraft * n_days)
+    scheduled_departure = (
+        pd.Timestamp(start) + pd.to_timedelta(day_offsets, unit='D')
+        + pd.to_timedelta(6 * 60 + slot * 300 + rng.integers(0, 30, n_flights), unit='min')
+    )
+    duration = pd.to_timedelta(rng.integers(60, 210, n_flights), unit='min')
+    delay = pd.to_timedelta(np.round(rng.exponential(12, n_flights)), unit='min')
+    cancelled = rng.random(n_flights) < 0.03
+
+    flights = pd.DataFrame({
+        'aircraftregistration': np.tile(np.repeat(registrations, flights_per_day), n_days),
+        'scheduleddeparture': scheduled_departure,
+        'scheduledarrival': scheduled_departure + duration,
+        'actualdeparture': scheduled_departure + delay,
+        'actualarrival': scheduled_departure + delay + duration + pd.to_timedelta(rng.integers(-10, 10, n_flights), unit='min'),
+        'cancelled': cancelled
+    })
+    flights.loc[cancelled, ['actualdeparture', 'actualarrival']] = pd.NaT
+
+    dirty = rng.random(n_flights) < dirty_ratio
+    kind = rng.integers(0, 3, n_flights)
+    inverted = dirty & (kind == 0) & ~cancelled # BR-23
+    flights.loc[inverted, ['actualdeparture', 'actualarrival']] = flights.loc[inverted, ['actualarrival', 'actualdeparture']].to_numpy()
+    overlapping = dirty & (kind == 1) & ~cancelled # BR-21 (arribada posterior a la sortida del següent vol)
+    flights.loc[overlapping, 'actualarrival'] = flights.loc[overlapping, 'actualarrival'] + pd.Timedelta(hours=6)
+    invalid = dirty & (kind == 2) # Aeronau inexistent
+    flights.loc[invalid, 'aircraftregistration'] = 'XX-0000'
+
+    # AIMS.maintenance: uns quants manteniments per aeronau i mes
+    n_maintenance = max(1, n_aircraft * n_days // 10)
+    maintenance_departure = (
+        pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, n_days, n_maintenance), unit='D')
+        + pd.to_timedelta(rng.integers(0, 24 * 60, n_maintenance), unit='min')
+    )
+    maintenance = pd.DataFrame({
+        'aircraftregistration': rng.choice(registrations, n_maintenance),
+        'scheduleddeparture': maintenance_departure,
+        'scheduledarrival': maintenance_departure + pd.to_timedelta(rng.integers(60, 3 * 24 * 60, n_maintenance), unit='min'),
+        'programmed': rng.random(n_maintenance) < 0.7
+    })
+
+    # AMOS.postflightreports: informes de pilots (PIREP) i de manteniment (MAREP)
+    n_reports = max(1, n_flights // 5)
+    is_maintenance = rng.random(n_reports) < 0.5
+    reports = pd.DataFrame({
+        'aircraftregistration': rng.choice(registrations, n_reports),
+        'reportingdate': pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, n_days, n_reports), unit='D'),
+        'reporteurid': np.where(is_maintenance, rng.choice(personnel['reporteurid'], n_reports), rng.integers(1, 999, n_reports)),
+        'reporteurclass': np.where(is_maintenance, 'MAREP', 'PIREP')
+    })
+    out_of_range = rng.random(n_reports) < dirty_ratio # Dates fora del rang d'AIMS (p. ex. 2100)
+    reports.loc[out_of_range, 'reportingdate'] = pd.Timestamp('2100-01-01')
+
+    if os.path.exists(filename):
+        os.remove(filename)
+    conn = duckdb.connect(filename)
+    conn.execute('CREATE SCHEMA "AIMS"; CREATE SCHEMA "AMOS";')
+    conn.register('flights_df', flights)
+    conn.register('maintenance_df', maintenance)
+    conn.register('reports_df', reports)
+    conn.execute('''
+        CREATE TABLE "AIMS".flights AS SELECT * FROM flights_df ORDER BY scheduleddeparture;
+        CREATE TABLE "AIMS".maintenance AS SELECT * FROM maintenance_df ORDER BY scheduleddeparture;
+        CREATE TABLE "AMOS".postflightreports AS SELECT * FROM reports_df ORDER BY reportingdate;
+        ''')
+    conn.close()
+    return {'AIMS.flights': len(flights), 'AIMS.maintenance': len(maintenance), 'AMOS.postflightreports': len(reports)}
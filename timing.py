@@ -0,0 +1,17 @@
+"""
+Mesura de temps compartida pels benchmarks
+"""
+import statistics
+import time
+
+
+def time_query(function, repetitions):
+    """
+    Executa function() repetitions vegades i retorna (mediana dels segons, resultat de l'última execució)
+    """
+    timings = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
@@ -1,30 +1,53 @@
 from tqdm import tqdm
-import logging
+import numpy as np
 import pandas as pd
 import datetime 
 from itertools import tee # Clonar iteradors fonts de dades
+import rejections
 
-# Configure logging
-logging.basicConfig(
-    filename='cleaning.log', # Log file name
-    level=logging.INFO, # Logging level
-    format='%(message)s' # Log message format
-)
-
-def build_dateCode(date) -> str:
-    return f"{date.year}-{date.month}-{date.day}"
+def build_calendar(dates, first_date=None, last_date=None):
+    """
+    Construeix les files de Date i Month de forma vectoritzada
+    Inclou els dies de cada mes (DaysInMonth) i els dies coberts per l'extracció (CoveredDays, retallats a
+    [first_date, last_date], per defecte la primera i l'última data) per calcular els KPIs amb la durada real del període
+    """
+    dates = pd.DatetimeIndex(sorted(dates))
+    first_date = pd.Timestamp(first_date if first_date is not None else dates[0])
+    last_date = pd.Timestamp(last_date if last_date is not None else dates[-1])
+    iso = dates.isocalendar() # Setmana ISO (pot pertànyer a l'any anterior/següent)
+    df_dates = pd.DataFrame({
+        'DateKey': dates.year * 10000 + dates.month * 100 + dates.day, # YYYYMMDD
+        'FullDate': dates.year.astype(str) + '-' + dates.month.astype(str) + '-' + dates.day.astype(str),
+        'Day': dates.day,
+        'Month': dates.month,
+        'Year': dates.year,
+        'ISOYear': iso['year'].to_numpy(dtype='int64'),
+        'ISOWeek': iso['week'].to_numpy(dtype='int64'),
+        'DaysInMonth': dates.days_in_month
+    })
+
+    df_months = df_dates.drop_duplicates(subset=['Year', 'Month']).copy()
+    df_months['MonthKey'] = df_months['Year'] * 100 + df_months['Month'] # YYYYMM
+    month_starts = pd.to_datetime(df_months['MonthKey'] * 100 + 1, format='%Y%m%d')
+    month_ends = month_starts + pd.to_timedelta(df_months['DaysInMonth'] - 1, unit='D')
+    df_months['CoveredDays'] = (month_ends.clip(upper=last_date) - month_starts.clip(lower=first_date)).dt.days + 1
+
+    date_data = df_dates.drop(columns=['DaysInMonth']).to_dict('records')
+    month_data = df_months[['MonthKey', 'Month', 'Year', 'DaysInMonth', 'CoveredDays']].to_dict('records')
+    return date_data, month_data
 
 # BR ValidAircraftRegistration
-def clean_invalid_aircraft(data_source, dw):
+def clean_invalid_aircraft(data_source, dw, rejection_sink=None, source_name=None):
     """
     Filtra els aircraftregistration invàlids (lookup a Aircraft)
+    Els registres ignorats van a rejection_sink (si n'hi ha) amb la font source_name
     """
     for row in data_source:
         aircraft_code = row.get('aircraftregistration')
         if aircraft_code and dw.aircraft_dim.lookup({'AircraftRegistrationCode': aircraft_code}):
             yield row
-        else:
-            logging.info(f"S'ignora el registre per codi d'aeronau incorrecte: {row}")
+        elif rejection_sink is not None:
+            rejection_sink.reject(rejections.INVALID_AIRCRAFT, source_name, row)
 
 # TODO: Implement here all transforming functions
 
@@ -79,36 +102,123 @@ def transform_date_dimensions(flights_source, maintenance_source, reports_source
 
     all_unique_dates = sorted(list(aims_dates.union(amos_dates)))
 
-    date_data = []
-    for current_date in tqdm(all_unique_dates, desc="Transformant i Carregant Dimensions Date i Month"):
-        date_data.append({
-            'DateKey': int(f"{current_date.year}{str(current_date.month).zfill(2)}{str(current_date.day).zfill(2)}"), # YYYYMMDD
-            'FullDate': build_dateCode(current_date),
-            'Day': current_date.day,
-            'Month': current_date.month,
-            'Year': current_date.year
-        })
-
-    month_data = []
-    seen_months = set()
-    for date_row in date_data:
-        month_key = date_row['Year'] * 100 + date_row['Month'] # YYYYMM
-        if month_key not in seen_months:
-            month_data.append({
-                'MonthKey': month_key,
-                'Month': date_row['Month'],
-                'Year': date_row['Year']
-            })
-            seen_months.add(month_key)
+    date_data, month_data = build_calendar(all_unique_dates, min_date, max_date)
 
     reports_filtered_iter = iter(df_reports_filtered.to_dict('records'))
     # Apart de dates, retorna iteradors de vols, manteniment i informes filtrats
     return date_data, month_data, flights2, maint2, reports_filtered_iter
 
-def transform_daily_utilization(flights_source, apply_cleaning=False):
+# ====================================================================================================================================
+# Kernel de mètriques de vols sobre arrays int64 (nanosegons des de l'època)
+NAT_NS = np.iinfo(np.int64).min # Valor de NaT vist com a int64
+NS_PER_MINUTE = 60 * 10**9
+NS_PER_HOUR = 60 * NS_PER_MINUTE
+DELAY_THRESHOLD_NS = 15 * NS_PER_MINUTE # 15 minuts o més, atrasat
+
+# Columnes afegides per extract.extract_flights_from_aims(flag_overlaps=True)
+BR21_CANDIDATE_COLUMN = 'br21_candidate'
+BR21_SEQUENCE_COLUMN = 'br21_sequence'
+
+def to_epoch_ns(datetimes):
+    """
+    Vista int64 (ns) d'una columna de dates, sense còpia si ja és datetime64[ns]
+    """
+    return datetimes.to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+def swap_inverted_times(departure, arrival):
+    """
+    BR-23: intercanvia sortida i arribada quan l'arribada és anterior. Retorna (sortida, arribada, màscara)
+    """
+    inverted = (arrival < departure) & (departure != NAT_NS) & (arrival != NAT_NS)
+    return np.where(inverted, arrival, departure), np.where(inverted, departure, arrival), inverted
+
+def compute_flight_metrics(actual_departure, actual_arrival, scheduled_arrival, cancelled):
+    """
+    Mètriques per vol a partir d'arrays int64 d'epoch (ns) i la màscara de cancel·lats
+    Cada diferència es calcula un sol cop i les sortides es preassignen
+    Els vols cancel·lats o sense hores reals no sumen hores ni retards (equivalent a ignorar els NaN en l'agregació)
+    """
+    n = len(cancelled)
+    flight_hours = np.empty(n, dtype=np.float64)
+    delay_minutes = np.empty(n, dtype=np.float64)
+
+    flown = ~cancelled
+    has_arrival = actual_arrival != NAT_NS
+    completed = flown & has_arrival & (actual_departure != NAT_NS)
+
+    # Duració real del vol en hores
+    np.divide(actual_arrival - actual_departure, NS_PER_HOUR, out=flight_hours)
+    flight_hours[~completed] = 0
+
+    # Retard en minuts (només si supera el llindar i el vol no està cancel·lat)
+    delay_ns = actual_arrival - scheduled_arrival
+    delayed = flown & has_arrival & (scheduled_arrival != NAT_NS) & (delay_ns > DELAY_THRESHOLD_NS)
+    np.divide(delay_ns, NS_PER_MINUTE, out=delay_minutes)
+    delay_minutes[~delayed] = 0
+
+    return {
+        'FlightCycles': flown.astype(np.int64),
+        'NumberOfCancellations': cancelled.astype(np.int64),
+        'FlightHours': flight_hours,
+        'NumberOfDelays': delayed.astype(np.int64),
+        'SumOfDelayDuration': delay_minutes
+    }
+
+def resolve_overlaps(df, group_columns, rejection_sink=None):
+    """
+    BR-21: elimina vols no cancel·lats que se solapen amb el següent del mateix grup (aeronau o tram de candidats)
+    Els empats de sortida es desfan per arribada i sortida programada (el mateix ordre que marca extract a la font)
+    """
+    sort_columns = group_columns + ['actualdeparture', 'actualarrival', 'scheduleddeparture']
+    df = df.sort_values(by=sort_columns).reset_index(drop=True)
+    """
+    Màscara booleana amb condicions:
+    (1) Vol actual i el següent són del mateix grup
+    (2) Vols no cancel·lats
+    (3) L'arribada real del vol actual és posterior a la sortida real del següent vol
+    """
+    while True:
+        same_group = np.ones(len(df), dtype=bool) # Comparar actual amb la següent
+        for column in group_columns:
+            same_group &= (df[column] == df[column].shift(-1)).to_numpy()
+        next_actualdep = df['actualdeparture'].shift(-1)
+        next_cancelled = df['cancelled'].astype('boolean').shift(-1) # Mirar si el següent cancel·lat
+
+        overlaps_mask = ( # Vol actual no cancel·lat, seguënt tampoc i arribada actual > sortida següent
+            same_group & (~df['cancelled']) & (~next_cancelled) & (df['actualarrival'] > next_actualdep)
+        )
+
+        if not overlaps_mask.any():
+            break # Cap solapament
+
+        # Registrar files eliminades
+        first_overlap = df[overlaps_mask].index[0]
+        if rejection_sink is not None:
+            rejection_sink.reject(rejections.OVERLAPPING_FLIGHT, 'AIMS.flights', df.loc[first_overlap].to_dict())
+
+        df.drop(first_overlap, inplace=True)
+        df.reset_index(drop=True, inplace=True)
+
+        df.sort_values(by=sort_columns, inplace=True)
+    return df
+
+def resolve_flagged_overlaps(df, rejection_sink=None):
+    """
+    BR-21 sobre els candidats marcats a la font (extract.extract_flights_from_aims(flag_overlaps=True))
+    Un vol no marcat mai s'elimina, així que cada tram de candidats consecutius d'una aeronau es resol per separat
+    """
+    candidates_mask = df[BR21_CANDIDATE_COLUMN].fillna(False).astype(bool)
+    candidates = df[candidates_mask].sort_values(by=['aircraftregistration', BR21_SEQUENCE_COLUMN])
+    # Els candidats consecutius comparteixen (posició - ordre entre candidats)
+    candidates['br21_run'] = candidates[BR21_SEQUENCE_COLUMN] - candidates.groupby('aircraftregistration').cumcount()
+    resolved = resolve_overlaps(candidates, ['aircraftregistration', 'br21_run'], rejection_sink).drop(columns=['br21_run'])
+    print(f"BR-21: s'han revisat {len(candidates)} vols candidats de {len(df)}")
+    return pd.concat([df[~candidates_mask], resolved], ignore_index=True).drop(columns=[BR21_CANDIDATE_COLUMN, BR21_SEQUENCE_COLUMN])
+
+def transform_daily_utilization(flights_source, apply_cleaning=False, rejection_sink=None):
     """
     Transforma les dades de vols en format diari per aeronau
-    apply_cleaning: si és True, s'apliquen les BR-21 i BR-23
+    apply_cleaning: si és True, s'apliquen les BR-21 i BR-23 (els vols eliminats van a rejection_sink)
     """
     df = pd.DataFrame(flights_source)
 
@@ -120,58 +230,28 @@ def transform_daily_utilization(flights_source, apply_cleaning=False):
     if apply_cleaning:
 
         # BR-23
-        inverted_dates_mask = df['actualarrival'] < df['actualdeparture']
-        df.loc[inverted_dates_mask, ['actualdeparture', 'actualarrival']] = \
-            df.loc[inverted_dates_mask, ['actualarrival', 'actualdeparture']].values # Intercanviem valors
+        actual_departure, actual_arrival, _ = swap_inverted_times(to_epoch_ns(df['actualdeparture']), to_epoch_ns(df['actualarrival']))
+        df['actualdeparture'] = actual_departure.view('datetime64[ns]')
+        df['actualarrival'] = actual_arrival.view('datetime64[ns]')
 
         # BR-21
-        df.sort_values(by=['aircraftregistration', 'actualdeparture'], inplace=True)
-        """
-        Màscara booleana amb condicions:
-        (1) Vol actual i el següent són de la mateixa aeronau
-        (2) Vols no cancel·lats
-        (3) L'arribada real del vol actual és posterior a la sortida real del següent vol
-        """
-        while True:
-            next_ac = df['aircraftregistration'].shift(-1) # Comparar actual amb la següent
-            next_actualdep = df['actualdeparture'].shift(-1)
-            next_cancelled = df['cancelled'].astype('boolean').shift(-1) # Mirar si el següent cancel·lat
-
-            overlaps_mask = ( # Vol actual no cancel·lat, seguënt tampoc i arribada actual > sortida següent
-                (df['aircraftregistration'] == next_ac) & (~df['cancelled']) & (~next_cancelled) & (df['actualarrival'] > next_actualdep)
-            )
-
-            if not overlaps_mask.any():
-                break # Cap solapament
-
-            # Log files eliminades
-            first_overlap = df[overlaps_mask].index[0]
-            logging.info(f"Violacio de BR-21: Vols solapats per l'aeronau {df.loc[first_overlap, 'aircraftregistration']}. S'ignora el vol: {df.loc[first_overlap].to_dict()}")
-
-            df.drop(first_overlap, inplace=True)
-            df.reset_index(drop=True, inplace=True)
-
-            df.sort_values(by=['aircraftregistration', 'actualdeparture'], inplace=True)
-        
+        if BR21_CANDIDATE_COLUMN in df.columns:
+            # Candidats ja marcats a l'extracció: només es resolen els vols marcats, per trams consecutius
+            df = resolve_flagged_overlaps(df, rejection_sink)
+        else:
+            df = resolve_overlaps(df, ['aircraftregistration'], rejection_sink)
+
         print(f"BR-21, BR-23 i BR-ValidAircraftRegistration aplicades correctament")
     
     df['date'] = df['scheduleddeparture'].dt.date
 
     # Càlcul de mètriques
-    df['FlightCycles'] = 1
-    df.loc[df['cancelled'], 'FlightCycles'] = 0 # Cancelat no compta
-    df['NumberOfCancellations'] = df['cancelled'].astype(int)
-
-    df['FlightHours'] = (df['actualarrival'] - df['actualdeparture']).dt.total_seconds() / 3600 # Duració real vol en hores
-    df.loc[df['cancelled'], 'FlightHours'] = 0 
-
-    # 15 minuts o més, atrasat
-    is_delayed = ((df['actualarrival'] - df['scheduledarrival']).dt.total_seconds() / 60) > 15 
-    df['NumberOfDelays'] = (is_delayed & ~df['cancelled']).astype(int) # Cancelat no compta
-
-    df['SumOfDelayDuration'] = (df['actualarrival'] - df['scheduledarrival']).dt.total_seconds() / 60 # Retràs en minuts
-
-    df.loc[~is_delayed | df['cancelled'], 'SumOfDelayDuration'] = 0
+    metrics = compute_flight_metrics(
+        to_epoch_ns(df['actualdeparture']), to_epoch_ns(df['actualarrival']),
+        to_epoch_ns(df['scheduledarrival']), df['cancelled'].to_numpy(dtype=bool)
+    )
+    for column, values in metrics.items():
+        df[column] = values
 
     # Agregació diaria per aeronau
     daily_summary = df.groupby(['date', 'aircraftregistration']).agg(
@@ -188,9 +268,10 @@ def transform_daily_utilization(flights_source, apply_cleaning=False):
         # Justificació: per evitar carregar tot a memoria
         yield row
 
-def transform_monthly_summary(maintenance_source, reports_source):
+def transform_monthly_summary(maintenance_source, reports_source, month_data):
     """
     Transformar dades de manteniment i reports de pilots per agrupar mensualment per aeronau
+    month_data: files de la dimensió Month (transform_date_dimensions), d'on surten els dies coberts de cada mes
     """
     df_maint = pd.DataFrame(maintenance_source)
     df_reports = pd.DataFrame(reports_source)
@@ -208,8 +289,6 @@ def transform_monthly_summary(maintenance_source, reports_source):
         ADOSS=('ADOSS', 'sum'), ADOSU=('ADOSU', 'sum')
     ).reset_index()
     
-    maint_summary['ADIS'] = 30.44 - (maint_summary['ADOSS'] + maint_summary['ADOSU']) # Dies mitjans per mes = 365.25 / 12 aprox 30.44
-    
     df_reports['reportingdate'] = pd.to_datetime(df_reports['reportingdate'])
     
     df_pilot_reports = df_reports[df_reports['reporteurclass'] == 'PIREP'].copy() # Només pilots
@@ -224,6 +303,10 @@ def transform_monthly_summary(maintenance_source, reports_source):
     final_summary = pd.merge(maint_summary, pilot_summary, on=['month_key', 'aircraftregistration'], how='outer')
     final_summary.fillna(0, inplace=True)
 
+    # Dies en servei sobre els dies coberts de cada mes (també pels mesos que només tenen informes)
+    covered_days = {month['MonthKey']: month['CoveredDays'] for month in month_data}
+    final_summary['ADIS'] = final_summary['month_key'].map(covered_days) - (final_summary['ADOSS'] + final_summary['ADOSU'])
+
     final_summary.rename(columns={'month_key': 'MonthKey'}, inplace=True)
 
     records = final_summary.to_dict('records')